@@ -0,0 +1,39 @@
+# advanced_mastering.py
+import numpy as np
+import librosa
+import instrumentation
+import loudness
+import separation
+import stems
+
+# The advanced mastering chain shared by the desktop tool (master_V1.0.py)
+# and the headless batch runner (batch_master.py). Functions raise on error;
+# callers decide how to report it.
+
+LOUDNESS_TARGET = -16.0  # LUFS
+
+
+def apply_advanced_processing(audio, sr, stem_chains=None):
+    # stem_chains maps stem names to stage specs, see stems.DEFAULT_STEM_CHAINS.
+    # Each step is timed as an instrumentation stage, recorded into the caller's trace if one is active.
+    duration = len(audio) / sr
+
+    # Apply high-quality high-pass filter using librosa, along the time axis of each channel
+    with instrumentation.stage('preemphasis', duration):
+        processed_audio = librosa.effects.preemphasis(np.asarray(audio, dtype=np.float32).T).T
+
+    # Normalize to the loudness target, measured in one block-wise pass
+    with instrumentation.stage('loudness_normalization', duration):
+        stats = loudness.analyze_array(processed_audio, sr)
+        processed_audio = processed_audio * np.float32(10 ** (loudness.normalization_gain(stats, LOUDNESS_TARGET) / 20))
+
+    # Apply source separation using Spleeter (5-stem model), loaded once per process
+    with instrumentation.stage('source_separation', duration):
+        separated_audio = separation.get_service().separate(processed_audio)
+
+    # Process each stem separately (EQ, compression, limiting) in parallel and
+    # combine the stems back together in a single mix buffer
+    with instrumentation.stage('stem_processing', duration):
+        processed_audio = stems.process_stems(separated_audio, sr, chains=stem_chains)
+
+    return processed_audio
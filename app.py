@@ -1,18 +1,114 @@
 # app.py
-from flask import Flask, render_template, request, flash, jsonify, redirect, url_for, get_flashed_messages
+from flask import Blueprint, Flask, Response, current_app, render_template, request, flash, jsonify, url_for, send_file
 from werkzeug.utils import secure_filename
+import importlib
 import os
-from audio_processor import AudioProcessor
+import threading
+from jobs import JobQueue, QueueFullError, JOB_DONE
+import instrumentation
+from uploads import UploadManager, UploadError, has_allowed_extension, sniff_stream
+from storage import StorageManager
+from delivery import DELIVERY_FORMATS
 from config import reviews_list
 from reviews import Review
 import datetime
 import sqlite3
+import database
+from review_feed import ReviewWriter, ReviewFeedCache
+from markupsafe import Markup
 
-app = Flask(__name__)
-app.config.from_object("config")
+# Modules behind the audio processor that pull in NumPy and SciPy. They are
+# imported when a request first needs them, or up front by preload().
+DSP_MODULES = ('numpy', 'scipy.signal', 'dsp', 'streaming', 'loudness', 'eq_match', 'audio_processor')
 
-# Initialize the audio processor
-audio_processor = AudioProcessor(app.config["UPLOAD_FOLDER"], app.config["OUTPUT_FOLDER"])
+main = Blueprint('main', __name__)
+
+def preload():
+    # Import the DSP stack now. Call it in a pre-fork server's master process
+    # (e.g. gunicorn --preload 'app:create_app(preload_dsp=True)') so forked
+    # workers share the imported modules instead of each importing on first use.
+    for name in DSP_MODULES:
+        importlib.import_module(name)
+
+class AppServices:
+    """Long-lived objects behind the routes, one set per app."""
+
+    def __init__(self, config):
+        self.config = config
+
+        # Reviews are written in batches, and each committed batch refreshes the cached feed
+        self.review_feed_cache = ReviewFeedCache(ttl=config["REVIEWS_CACHE_TTL"])
+        self.review_writer = ReviewWriter(batch_size=config["REVIEW_BATCH_SIZE"], flush_interval=config["REVIEW_FLUSH_INTERVAL"],
+                                          durability=config["REVIEW_DURABILITY"], on_commit=self.review_feed_cache.invalidate)
+
+        self.processor_options = {
+            'use_streaming': config["STREAMING_MASTERING"],
+            'block_size': config["STREAMING_BLOCK_SIZE"],
+            'render_cache_size': config["RENDER_CACHE_SIZE"],
+            'prerender_formats': config["PRERENDER_FORMATS"],
+            'playback_format': config["PLAYBACK_FORMAT"],
+            'loudness_target': config["LOUDNESS_TARGET"],
+            'storage_database': config["STORAGE_DATABASE"],
+        }
+
+        # Mastering runs in a process pool fed by a persistent job queue
+        self.job_queue = JobQueue(config["JOBS_DATABASE"], config["UPLOAD_FOLDER"], config["OUTPUT_FOLDER"],
+                                  max_workers=config["MASTERING_WORKERS"], max_queued=config["MAX_QUEUED_JOBS"],
+                                  processor_options=self.processor_options,
+                                  trace_folder=os.path.join(config["OUTPUT_FOLDER"], 'traces') if config["SAVE_JOB_TRACES"] else None)
+
+        # Resumable uploads measure loudness while they arrive, into the folder AudioProcessor reads
+        # (audio_processor.LOUDNESS_FOLDER), so mastering starts with the measurement cached
+        loudness_cache = os.path.join(config["OUTPUT_FOLDER"], 'loudness') if config["LOUDNESS_TARGET"] is not None else None
+        self.upload_manager = UploadManager(config["UPLOAD_FOLDER"], config["MAX_UPLOAD_SIZE"], config["MAX_UPLOAD_CHUNK_SIZE"],
+                                            loudness_cache=loudness_cache, block_size=config["STREAMING_BLOCK_SIZE"],
+                                            live_idle_timeout=config["UPLOAD_LIVE_IDLE_TIMEOUT"])
+
+        # Keeps the folders within their quota; files that queued and running jobs need are never evicted
+        self.storage = StorageManager(config["STORAGE_DATABASE"], {'uploads': config["UPLOAD_FOLDER"], 'output': config["OUTPUT_FOLDER"]},
+                                      max_bytes=config["STORAGE_MAX_BYTES"], max_age=config["STORAGE_MAX_AGE"],
+                                      min_age=config["STORAGE_MIN_AGE"], sweep_interval=config["STORAGE_SWEEP_INTERVAL"],
+                                      protected=self.job_queue.active_files)
+
+        self._audio_processor = None
+        self._lock = threading.Lock()
+
+    @property
+    def audio_processor(self):
+        # Created on first use so that starting a worker does not import the DSP stack
+        if self._audio_processor is None:
+            with self._lock:
+                if self._audio_processor is None:
+                    from audio_processor import AudioProcessor
+
+                    self._audio_processor = AudioProcessor(self.config["UPLOAD_FOLDER"], self.config["OUTPUT_FOLDER"],
+                                                           **self.processor_options)
+        return self._audio_processor
+
+def create_app(config_object="config", preload_dsp=None):
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+
+    # Set up the reviews database once at startup
+    database.init_db(app.config["REVIEWS_DATABASE"])
+
+    app.extensions['aurora'] = AppServices(app.config)
+    app.register_blueprint(main)
+
+    if preload_dsp is None:
+        preload_dsp = app.config.get("PRELOAD_DSP", False)
+    if preload_dsp:
+        preload()
+    return app
+
+def services():
+    return current_app.extensions['aurora']
+
+@main.before_app_request
+def start_background_work():
+    # Started lazily so that importing app.py (e.g. in a spawned pool worker) has no side effects
+    services().job_queue.start()
+    services().storage.start()
 
 def handle_db_error(error):
     flash("Database error: {}".format(error), "error")
@@ -23,29 +119,70 @@ def handle_upload_error(error):
 def handle_processing_error(error):
     flash("Processing error: {}".format(error), "error")
 
-@app.route('/')
+def render_reviews_fragment():
+    # Only the first page is rendered; the page fetches the rest from /api/reviews on scroll
+    reviews_data, next_cursor = database.fetch_reviews_page(current_app.config["REVIEWS_PER_PAGE"])
+
+    # Create Review objects from the retrieved data
+    reviews = [Review(content=review[2], author=review[1], timestamp=review[3], id=review[0]) for review in reviews_data]
+
+    return Markup(render_template('_reviews.html', reviews=reviews, next_cursor=next_cursor))
+
+@main.route('/')
 def index():
     try:
-        # Create a connection to the database
-        conn = sqlite3.connect('reviews.db')
-        cursor = conn.cursor()
+        # A cache hit serves the reviews fragment without touching the database
+        reviews_html = services().review_feed_cache.get(render_reviews_fragment)
+        return render_template('index.html', reviews_html=reviews_html)
+    except sqlite3.Error as e:
+        handle_db_error(e)
+        return render_template('index.html', reviews_html=Markup(render_template('_reviews.html', reviews=[], next_cursor=None)))
 
-        # Retrieve reviews from the database
-        cursor.execute('SELECT author, content, timestamp FROM reviews')
-        reviews_data = cursor.fetchall()
+@main.route('/api/reviews', methods=['GET'])
+def list_reviews():
+    limit = min(request.args.get('limit', current_app.config["REVIEWS_PER_PAGE"], type=int), current_app.config["MAX_REVIEWS_PER_PAGE"])
+    before = request.args.get('before', type=int)
 
-        # Close the connection
-        conn.close()
+    try:
+        reviews_data, next_cursor = database.fetch_reviews_page(max(limit, 1), before)
+        reviews = [Review(content=review[2], author=review[1], timestamp=review[3], id=review[0]) for review in reviews_data]
+        return jsonify({'reviews': [review.to_dict() for review in reviews], 'next_cursor': next_cursor})
+    except sqlite3.Error as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        # Create Review objects from the retrieved data
-        reviews = [Review(content=review[1], author=review[0], timestamp=review[2]) for review in reviews_data]
+def is_audio_upload(file):
+    # The extension and the header bytes must both say WAV or MP3
+    return has_allowed_extension(file.filename, current_app.config["ALLOWED_EXTENSIONS"]) and sniff_stream(file.stream) is not None
 
-        return render_template('index.html', reviews=reviews)
-    except sqlite3.Error as e:
-        handle_db_error(e)
-        return render_template('index.html', reviews=[])
+def mastering_options():
+    # Optional reference track (a new upload, or one already saved for a preview) and parallel compression toggle
+    options = {}
+    reference = request.files.get('reference')
+    if reference and reference.filename:
+        if not is_audio_upload(reference):
+            raise ValueError('Invalid reference file format')
+        options['reference'] = services().audio_processor.save_reference(reference)
+    elif request.form.get('reference'):
+        reference_name = secure_filename(os.path.basename(request.form['reference']))
+        if services().storage.lookup('uploads', f"references/{reference_name}") is None:
+            raise ValueError('Unknown reference file')
+        options['reference'] = f"references/{reference_name}"
+    if request.form.get('parallel_compression'):
+        options['parallel_compression'] = True
+    return options
 
-@app.route('/upload', methods=['POST'])
+def enqueue_mastering(filename, quality, audio_type, options=None):
+    try:
+        job_id = services().job_queue.submit(filename, quality, audio_type, options)
+    except QueueFullError as e:
+        response = jsonify({'success': False, 'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    return jsonify({'success': True, 'job_id': job_id, 'original_filename': filename,
+                    'status_url': url_for('main.check_mastering_status', job_id=job_id)}), 202
+
+@main.route('/upload', methods=['POST'])
 def upload_file():
     file = request.files.get('file')
 
@@ -53,19 +190,93 @@ def upload_file():
         handle_upload_error('No file uploaded')
         return jsonify({'error': 'No file uploaded'})
 
-    if audio_processor.is_allowed_file(file.filename):
+    if is_audio_upload(file):
         try:
-            # Inform the user that the upload process has started
-            flash('Uploading...', 'info')
+            filename = services().audio_processor.save_upload(file)
+            return enqueue_mastering(filename, request.form.get('quality'), request.form.get('audio_type'), mastering_options())
+        except Exception as e:
+            handle_processing_error(e)
+            return jsonify({'success': False, 'error': str(e)})
+    else:
+        handle_upload_error('Invalid file format')
+        return jsonify({'error': 'Invalid file format'})
+
+@main.route('/uploads', methods=['POST'])
+def create_upload():
+    # Start a resumable upload; the mastering settings are kept until the last part arrives
+    filename = request.form.get('filename', '')
+    if not has_allowed_extension(filename, current_app.config["ALLOWED_EXTENSIONS"]):
+        return jsonify({'success': False, 'error': 'Invalid file format'}), 415
+
+    try:
+        metadata = {'quality': request.form.get('quality'), 'audio_type': request.form.get('audio_type'),
+                    'options': mastering_options()}
+        session = services().upload_manager.create(filename, request.form.get('size', 0, type=int), metadata)
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({'success': True, 'upload_id': session['id'], 'offset': session['offset'],
+                    'upload_url': url_for('main.upload_part', upload_id=session['id'])}), 201
 
-            output_filename = audio_processor.process_audio(file, request.form.get('quality'), request.form.get('audio_type'))
+@main.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    # Clients resume an interrupted upload from the offset reported here
+    try:
+        session = services().upload_manager.status(upload_id)
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    return jsonify({'success': True, 'offset': session['offset'], 'size': session['size']})
+
+@main.route('/uploads/<upload_id>', methods=['PATCH'])
+def upload_part(upload_id):
+    # The body is the raw part, written to disk as it is read; Upload-Offset says where it starts
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'success': False, 'error': 'Missing Upload-Offset header'}), 400
+
+    manager = services().upload_manager
+    try:
+        session = manager.write_chunk(upload_id, offset, request.stream, request.content_length)
+        if session['offset'] < session['size']:
+            return jsonify({'success': True, 'offset': session['offset']})
+        filename, metadata = manager.finish(upload_id)
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+    # The last part completes the upload and queues it with the settings given at creation
+    return enqueue_mastering(filename, metadata.get('quality'), metadata.get('audio_type'), metadata.get('options'))
+
+@main.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    try:
+        services().upload_manager.abort(upload_id)
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    return jsonify({'success': True})
+
+@main.route('/preview', methods=['POST'])
+def preview_file():
+    file = request.files.get('file')
+
+    if not file:
+        handle_upload_error('No file uploaded')
+        return jsonify({'error': 'No file uploaded'})
 
-            # Inform the user that the mastering process has started
-            flash('Mastering in progress...', 'info')
+    if is_audio_upload(file):
+        try:
+            # The excerpt is short and low-rate, so it is rendered inline rather than queued
+            filename = services().audio_processor.save_upload(file)
+            quality = request.form.get('quality')
+            audio_type = request.form.get('audio_type')
+            options = mastering_options()
+            preview_filename = services().audio_processor.render_preview(filename, quality, audio_type,
+                                                              duration=current_app.config["PREVIEW_DURATION"],
+                                                              sample_rate=current_app.config["PREVIEW_SAMPLE_RATE"], **options)
 
-            flash('File uploaded and mastered successfully', 'success')
-            flash('Mastering completed', 'info')
-            return redirect(url_for('play_mastered', filename=output_filename))
+            return jsonify({'success': True, 'original_filename': filename, 'quality': quality, 'audio_type': audio_type,
+                            'options': options, 'preview_url': url_for('main.play_preview', filename=preview_filename)})
         except Exception as e:
             handle_processing_error(e)
             return jsonify({'success': False, 'error': str(e)})
@@ -73,22 +284,34 @@ def upload_file():
         handle_upload_error('Invalid file format')
         return jsonify({'error': 'Invalid file format'})
 
-@app.route('/submit_review', methods=['POST'])
+@main.route('/preview/accept', methods=['POST'])
+def accept_preview():
+    # Start the full-quality render of a file that was already uploaded for preview
+    filename = secure_filename(request.form.get('filename', ''))
+    if not filename or services().storage.lookup('uploads', filename) is None:
+        return jsonify({'success': False, 'error': 'Unknown preview file'}), 404
+
+    try:
+        options = mastering_options()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return enqueue_mastering(filename, request.form.get('quality'), request.form.get('audio_type'), options)
+
+@main.route('/play_preview/<filename>')
+def play_preview(filename):
+    return services().audio_processor.play_preview(secure_filename(filename))
+
+@main.route('/submit_review', methods=['POST'])
 def submit_review():
     author = request.form.get('author')
     content = request.form.get('content')
+    if not author or not author.strip() or not content or not content.strip():
+        return jsonify({'success': False, 'error': 'Author and content are required'}), 400
 
     try:
-        # Create a connection to the database
-        conn = sqlite3.connect('reviews.db')
-        cursor = conn.cursor()
-
-        # Insert the new review into the database
-        cursor.execute('INSERT INTO reviews (author, content) VALUES (?, ?)', (author, content))
-
-        # Commit the changes and close the connection
-        conn.commit()
-        conn.close()
+        # Buffer the review; it is inserted with the next batch
+        services().review_writer.submit(author, content)
 
         timestamp = datetime.datetime.now()
         new_review = Review(content, author, timestamp)
@@ -103,35 +326,92 @@ def submit_review():
         handle_db_error(e)
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/check_mastering_status', methods=['GET'])
+@main.route('/check_mastering_status', methods=['GET'])
 def check_mastering_status():
-    # Implement logic to check mastering status
-    mastering_completed = True  # Replace with your actual logic
-    return jsonify({'mastering_completed': mastering_completed})
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({'error': 'Missing job_id'}), 400
 
-@app.route('/download/<format>/<filename>')
+    job = services().job_queue.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+
+    return jsonify({
+        'job_id': job['id'],
+        'state': job['state'],
+        'progress': job['progress'],
+        'message': job['message'],
+        'queue_position': job.get('queue_position'),
+        'mastering_completed': job['state'] == JOB_DONE,
+        'original_filename': job['filename'],
+        'filename': job['output_filename'],
+        'error': job['error'],
+    })
+
+@main.route('/job_trace/<job_id>', methods=['GET'])
+def job_trace(job_id):
+    job_queue = services().job_queue
+    job_id = secure_filename(job_id)
+    if not job_queue.trace_folder or not os.path.exists(job_queue.trace_path(job_id)):
+        return jsonify({'error': 'No trace for this job'}), 404
+    return send_file(os.path.abspath(job_queue.trace_path(job_id)), mimetype='application/json')
+
+@main.route('/metrics', methods=['GET'])
+def metrics():
+    # Stage latency histograms and totals for this web process, in the Prometheus text format
+    return Response(instrumentation.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@main.route('/storage_stats', methods=['GET'])
+def storage_stats():
+    return jsonify(services().storage.stats())
+
+@main.route('/render_cache_stats', methods=['GET'])
+def render_cache_stats():
+    if services().audio_processor.render_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(services().audio_processor.render_cache.stats(), enabled=True))
+
+@main.route('/download/<format>/<filename>')
 def download_audio(format, filename):
-    if format == 'mp3':
-        return audio_processor.download_file(filename, format='mp3')
-    elif format == 'wav':
-        return audio_processor.download_file(filename, format='wav')
+    if format == 'wav' or format in DELIVERY_FORMATS:
+        return services().audio_processor.download_file(filename, format=format)
     else:
         flash('Invalid format', 'error')
         return "Invalid format", 400
 
-@app.route('/play_original/<filename>')
+@main.route('/play_original/<filename>')
 def play_original(filename):
-    return audio_processor.play_original(filename)
+    return services().audio_processor.play_original(filename)
 
-@app.route('/play_mastered/<filename>')
+@main.route('/play_mastered/<filename>')
 def play_mastered(filename):
-    flash_messages = get_flashed_messages()
-    return render_template('index.html', flash_messages=flash_messages, output_filename=filename)
+    return services().audio_processor.play_mastered(filename)
+
+@main.route('/summary/<kind>/<filename>')
+def summary(kind, filename):
+    # One level of a file's waveform (int8 min/max pairs) or spectrogram (uint8
+    # band levels, one row per frame), picked to fit ?width= points
+    filename = secure_filename(filename)
+    view = request.args.get('view', 'waveform')
+    if kind not in ('original', 'mastered') or view not in ('waveform', 'spectrogram') \
+            or services().storage.lookup('uploads' if kind == 'original' else 'output', filename) is None:
+        return "Summary not found", 404
+
+    data, samples_per_point, info, path = services().audio_processor.summary(
+        kind, filename, view, max(1, request.args.get('width', 1000, type=int)))
+    response = Response(data.tobytes(), mimetype='application/octet-stream')
+    response.headers['X-Samples-Per-Point'] = str(samples_per_point)
+    response.headers['X-Sample-Rate'] = str(info[0])
+    response.headers['X-Frames'] = str(info[1])
+    response.headers['X-Bands'] = str(data.shape[1] if view == 'spectrogram' else 0)
 
-@app.route('/pause_audio')
-def pause_audio():
-    audio_processor.pause_audio()
-    return 'Audio paused'
+    # The summary changes only when its file is re-rendered, so browsers revalidate cheaply by ETag
+    stat = os.stat(path)
+    response.set_etag(f"{stat.st_mtime_ns}-{stat.st_size}-{view}-{samples_per_point}")
+    response.last_modified = stat.st_mtime
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
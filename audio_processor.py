@@ -1,61 +1,445 @@
-# app.py
-from pydub import AudioSegment
-import pygame
+# audio_processor.py
 import os
-from werkzeug.utils import secure_filename
-from flask import Flask, render_template, request, flash, jsonify, redirect, url_for, get_flashed_messages, send_file
+import uuid
+from flask import flash, has_request_context
 import numpy as np
-from scipy import signal
-import sqlite3
+import logging
+import dsp
+import streaming
+from render_cache import RenderCache, cache_key, file_digest
+import delivery
+import playback
+import mimetypes
+import loudness
+import eq_match
+import instrumentation
+import presets
+import peaks
+import storage
+
+logger = logging.getLogger(__name__)
+
+PREVIEWS_FOLDER = 'previews'
+LOUDNESS_FOLDER = 'loudness'
+SPECTRA_FOLDER = 'spectra'
+REFERENCES_FOLDER = 'references'
+SUMMARIES_FOLDER = 'summaries'
+
+# Metric name and whole-file progress message, by stage type
+STAGES = {
+    dsp.FirFilter: ('reference_eq', 'Reference EQ match applied'),
+    dsp.SosFilter: ('eq', 'EQ applied'),
+    dsp.Gain: ('gain', 'Gain applied'),
+    dsp.Compressor: ('compressor', 'Compression applied'),
+    dsp.ParallelCompressor: ('parallel_compression', 'Parallel compression applied'),
+    dsp.SideHighPass: ('high_pass_filter', 'High-pass filter applied'),
+    dsp.LookaheadLimiter: ('limiter', 'Limiter applied'),
+    dsp.MultibandExpander: ('multiband_expander', 'Multi-band expander applied'),
+}
 
 class AudioProcessor:
-    def __init__(self, upload_folder, output_folder):
+    # Bump whenever the mastering chain changes so cached renders are not reused
+    CHAIN_VERSION = 3
+
+    def __init__(self, upload_folder, output_folder, use_streaming=True, block_size=streaming.DEFAULT_BLOCK_SIZE,
+                 render_cache_size=0, prerender_formats=(), playback_format='mp3', loudness_target=None,
+                 presets_folder=presets.PRESETS_FOLDER, storage_database=None):
         self.upload_folder = upload_folder
         self.output_folder = output_folder
-        pygame.mixer.init()
+        self.use_streaming = use_streaming  # Decode, process and encode in fixed-size blocks
+        self.block_size = block_size
+        self.render_cache = RenderCache(output_folder, render_cache_size, on_evict=self.forget_render) if render_cache_size else None
+        self.prerender_formats = list(prerender_formats)  # Delivery formats transcoded as soon as mastering ends
+        self.playback_format = playback_format  # Rendition streamed to the browser player, None for the WAV itself
+        self.loudness_target = loudness_target  # Integrated LUFS the input is gained to, None to skip
+        self.loudness_cache = os.path.join(output_folder, LOUDNESS_FOLDER)  # Measurements kept per upload digest
+        self.spectra_cache = os.path.join(output_folder, SPECTRA_FOLDER)  # Average spectra for reference matching
+        self.presets_folder = presets_folder  # One JSON chain description per quality, optionally per audio type
+        self.summaries_folder = os.path.join(output_folder, SUMMARIES_FOLDER)  # Waveform and spectrogram summaries
+        # Index of stored files, for lookups and LRU eviction; None probes the disk instead
+        self.storage = storage.StorageManager(storage_database, {'uploads': upload_folder, 'output': output_folder}) \
+            if storage_database else None
 
     def is_allowed_file(self, filename):
         ALLOWED_EXTENSIONS = {'mp3', 'wav'}
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-    def process_audio(self, file, quality, audio_type):
-        try:
-            if not os.path.exists(self.upload_folder):
-                os.makedirs(self.upload_folder)
-            if not os.path.exists(self.output_folder):
-                os.makedirs(self.output_folder)
-
-            filename = secure_filename(file.filename)
-            uploaded_filepath = os.path.join(self.upload_folder, filename)
-            file.save(uploaded_filepath)
-
-            audio = AudioSegment.from_file(uploaded_filepath)
-
-            # Inform the user that the upload process has completed
-            flash('Upload completed', 'info')
-
-            # Apply high-pass filter on side image (make low frequencies mono)
-            audio = self.apply_high_pass_filter(audio, cutoff_freq=130)
-            flash('High-pass filter applied', 'info')
-
-            # Use two limiters in series
-            audio = self.apply_limiter(audio, release_time=30)  # First limiter
-            flash('First limiter applied', 'info')
-
-            audio = self.apply_limiter(audio, release_time=100)  # Second limiter
-            flash('Second limiter applied', 'info')
+    def notify(self, message, category='info'):
+        # Flash messages only exist inside a request; pool workers have none
+        if has_request_context():
+            flash(message, category)
+        else:
+            logger.log(logging.ERROR if category == 'error' else logging.INFO, message)
+
+    def find_file(self, area, name):
+        # Path of a stored file ('uploads' or 'output' area), or None; also marks it as recently used
+        if self.storage is not None:
+            return self.storage.lookup(area, name)
+        path = os.path.join(self.upload_folder if area == 'uploads' else self.output_folder, name)
+        return path if os.path.exists(path) else None
+
+    def add_file(self, area, name):
+        if self.storage is not None:
+            self.storage.register(area, name)
+
+    def cached_file(self, path):
+        # A cache file under the output folder, or None; a hit marks it as used, so eviction sees reads
+        return self.find_file('output', os.path.relpath(path, self.output_folder).replace(os.sep, '/'))
+
+    def add_cached_file(self, path):
+        self.add_file('output', os.path.relpath(path, self.output_folder).replace(os.sep, '/'))
+
+    def cached_loudness(self, digest):
+        if self.cached_file(loudness.cache_path(self.loudness_cache, digest)) is None:
+            return None
+        return loudness.read_cached(self.loudness_cache, digest)
 
-            # Apply multi-band expander
-            audio = self.apply_multiband_expander(audio)
-            flash('Multi-band expander applied', 'info')
+    def store_loudness(self, digest, stats):
+        loudness.store_cached(self.loudness_cache, digest, stats)
+        self.add_cached_file(loudness.cache_path(self.loudness_cache, digest))
 
-            # Export audio in a lossless format (WAV) with high-quality settings
-            output_filename = f"mastered_{quality}_{audio_type}_{filename}"
-            output_filepath = os.path.join(self.output_folder, output_filename)
+    def cached_spectrum(self, digest, sample_rate, view='mid'):
+        if self.cached_file(eq_match.cache_path(self.spectra_cache, digest, sample_rate, view=view)) is None:
+            return None
+        return eq_match.read_cached(self.spectra_cache, digest, sample_rate, view=view)
+
+    def store_spectrum(self, digest, sample_rate, power, view='mid'):
+        eq_match.store_cached(self.spectra_cache, digest, sample_rate, power, view=view)
+        self.add_cached_file(eq_match.cache_path(self.spectra_cache, digest, sample_rate, view=view))
+
+    def file_spectrum(self, filepath, sample_rate):
+        # Average spectrum of a file such as a reference track, cached by file digest,
+        # so one reference serves many tracks for the cost of one analysis
+        digest = file_digest(filepath)
+        power = self.cached_spectrum(digest, sample_rate)
+        if power is None:
+            power = eq_match.analyze_file(filepath, sample_rate, block_size=self.block_size)
+            self.store_spectrum(digest, sample_rate, power)
+        return power
+
+    def forget_render(self, output_filename):
+        # The render cache removed a render and its renditions
+        if self.storage is not None:
+            self.storage.forget('output', output_filename)
+            for format in delivery.DELIVERY_FORMATS:
+                self.storage.forget('output', self.rendition_name(output_filename, format))
+
+    def save_upload(self, file):
+        if not os.path.exists(self.upload_folder):
+            os.makedirs(self.upload_folder)
+
+        # Every upload gets its own name, so a job never sees another upload's audio
+        filename = storage.unique_name(file.filename)
+        with storage.atomic_write(os.path.join(self.upload_folder, filename)) as temp_filepath:
+            file.save(temp_filepath)
+        self.add_file('uploads', filename)
+
+        return filename
+
+    def save_reference(self, file):
+        # Reference tracks live in their own folder; the returned name is relative to the upload folder
+        references_folder = os.path.join(self.upload_folder, REFERENCES_FOLDER)
+        os.makedirs(references_folder, exist_ok=True)
+
+        filename = f"{REFERENCES_FOLDER}/{storage.unique_name(file.filename)}"
+        with storage.atomic_write(os.path.join(self.upload_folder, filename)) as temp_filepath:
+            file.save(temp_filepath)
+        self.add_file('uploads', filename)
+
+        return filename
+
+    def load_preset(self, quality, audio_type):
+        return presets.load_preset(quality, audio_type, self.presets_folder)
+
+    def mastering_params(self, quality, audio_type, reference=None, parallel_compression=False):
+        # Everything that changes the rendered audio, for the cache keys; the
+        # preset's stages are included so editing a preset invalidates its renders
+        params = {'quality': quality, 'audio_type': audio_type, 'chain': self.CHAIN_VERSION,
+                  'loudness_target': self.loudness_target, 'stages': self.load_preset(quality, audio_type)['stages']}
+        if reference:
+            params['reference'] = file_digest(os.path.join(self.upload_folder, reference))
+        if parallel_compression:
+            params['parallel_compression'] = True
+        return params
+
+    def master_file(self, filename, quality, audio_type, progress=None, reference=None, parallel_compression=False):
+        # Run the mastering chain on an uploaded file and return the output filename.
+        # progress(fraction, message) is called after each stage. reference is a
+        # track in the upload folder whose tonal balance the master is matched to.
+        if progress is None:
+            progress = lambda fraction, message: None
+
+        if not os.path.exists(self.output_folder):
+            os.makedirs(self.output_folder)
+
+        options = {'reference': reference, 'parallel_compression': parallel_compression}
+        output_filename = self.render_or_reuse(filename, quality, audio_type, progress, options)
+        self.prerender_deliveries(output_filename)
+        return output_filename
+
+    def render_or_reuse(self, filename, quality, audio_type, progress, options):
+        uploaded_filepath = os.path.join(self.upload_folder, filename)
+        preset = self.load_preset(quality, audio_type)
+        # Masters are WAV whatever the upload's format
+        name = f"{os.path.splitext(filename)[0]}.wav"
+        if self.render_cache is None:
+            # A fresh name per render, so a master being played or downloaded is never rewritten
+            output_filename = f"mastered_{quality}_{audio_type}_{uuid.uuid4().hex[:8]}_{name}"
+            self.render_master(uploaded_filepath, os.path.join(self.output_folder, output_filename), progress,
+                               preset=preset, **options)
+            self.add_file('output', output_filename)
+            return output_filename
+
+        # Identical audio with identical settings is served from the render cache
+        key = cache_key(uploaded_filepath, self.mastering_params(quality, audio_type, **options))
+        cached_filename = self.render_cache.lookup(key)
+        if cached_filename is not None and self.find_file('output', cached_filename) is not None:
+            progress(1.0, 'Mastering completed (cached)')
+            return cached_filename
+
+        # The key is part of the name so different audio uploaded under the same name never collides
+        output_filename = f"mastered_{quality}_{audio_type}_{key[:12]}_{name}"
+        self.render_master(uploaded_filepath, os.path.join(self.output_folder, output_filename), progress,
+                           preset=preset, **options)
+        output_filename = self.render_cache.add(key, output_filename)
+        self.add_file('output', output_filename)
+        return output_filename
+
+    def prerender_deliveries(self, output_filename):
+        # A failed transcode is retried on the first download, so it must not fail the job
+        for format in self.prerender_formats:
+            try:
+                self.rendition(output_filename, format)
+            except Exception as e:
+                self.notify(f'Error preparing {format} download: {str(e)}', 'error')
+
+    def render_master(self, uploaded_filepath, output_filepath, progress, reference=None, parallel_compression=False,
+                      preset=None):
+        info = streaming.probe(uploaded_filepath)
+        with instrumentation.stage('input_analysis'):
+            stats, input_power, channel_power = self.analyze_input(uploaded_filepath, info, spectrum=bool(reference))
+        eq_taps = None
+        if reference:
+            with instrumentation.stage('reference_analysis'):
+                eq_taps = self.reference_eq_taps(input_power, reference, info.sample_rate)
+        gain_db = self.loudness_gain(stats, eq_taps, channel_power, info.sample_rate)
+        chain = self.build_mastering_chain(info.sample_rate, info.channels, gain_db, eq_taps=eq_taps,
+                                           parallel_compression=parallel_compression, preset=preset)
+        timed_stages = self.time_stages(chain, info.sample_rate)
+
+        # Summaries of the input and of the output are built from the blocks as they pass
+        original_summary = peaks.SummaryBuilder(info.sample_rate)
+        mastered_summary = peaks.SummaryBuilder(info.sample_rate, skip=chain.latency)
+
+        if self.use_streaming:
+            # Memory stays bounded by the block size whatever the track length
+            # The master is encoded under a temporary name and renamed into place once complete
+            chain.stages = [original_summary] + chain.stages + [mastered_summary]
+            with storage.atomic_write(output_filepath) as temp_filepath:
+                streaming.process_stream(chain, uploaded_filepath, temp_filepath, self.block_size,
+                                         progress=lambda fraction: progress(0.05 + 0.9 * fraction, 'Mastering in progress'))
+            for stage in timed_stages:
+                stage.timing.finish()
+            self.save_summaries(uploaded_filepath, original_summary, output_filepath, mastered_summary)
+            progress(1.0, 'Mastering completed')
+            return
+
+        with instrumentation.stage('decode') as timing:
+            samples, sample_rate = streaming.read_audio(uploaded_filepath, info.sample_rate, info.channels)
+            timing['audio_seconds'] = len(samples) / sample_rate
+        original_summary.process(samples)
+        progress(0.1, 'Upload completed')
+
+        # Run the stages one at a time on the whole signal; the chain carries the
+        # same state as in streaming mode, so both modes give identical output
+        # (to within FFT rounding when a reference EQ is in the chain)
+        for index, stage in enumerate(chain.stages):
+            samples = stage.process(samples)
+            progress(0.1 + 0.8 * (index + 1) / len(chain.stages), STAGES.get(type(stage.processor), ('', 'Stage applied'))[1])
+        samples = np.concatenate([samples, chain.flush()])[chain.latency:]
+        for stage in timed_stages:
+            stage.timing.finish()
+        mastered_summary = peaks.SummaryBuilder(sample_rate)
+        mastered_summary.process(samples)
+
+        # Export audio in a lossless format (WAV) with 24-bit samples for higher quality
+        with instrumentation.stage('encode', len(samples) / sample_rate), storage.atomic_write(output_filepath) as temp_filepath:
+            with streaming.StreamEncoder(temp_filepath, sample_rate, info.channels) as encoder:
+                encoder.write(samples)
+        self.save_summaries(uploaded_filepath, original_summary, output_filepath, mastered_summary)
+        progress(1.0, 'Mastering completed')
+
+    def save_summaries(self, uploaded_filepath, original_summary, output_filepath, mastered_summary):
+        # The player rebuilds a missing summary on request, so a failed save must not fail the job
+        try:
+            with instrumentation.stage('summaries'):
+                for kind, summary, filepath in (('original', original_summary, uploaded_filepath),
+                                                ('mastered', mastered_summary, output_filepath)):
+                    path = peaks.summary_path(self.summaries_folder, kind, os.path.basename(filepath))
+                    summary.save(path)
+                    self.add_cached_file(path)
+        except Exception as e:
+            self.notify(f'Error saving waveform summaries: {str(e)}', 'error')
+
+    def summary(self, kind, filename, view, width):
+        # One level of the waveform or spectrogram of an original or mastered
+        # file as (array, samples per point, info, summary path). Files mastered
+        # before summaries existed, or served from the render cache under a new
+        # upload name, are summarised on first request.
+        folder = self.upload_folder if kind == 'original' else self.output_folder
+        filepath = os.path.join(folder, filename)
+        path = peaks.summary_path(self.summaries_folder, kind, filename)
+        if self.cached_file(path) is None or not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(filepath):
+            info = streaming.probe(filepath)
+            builder = peaks.SummaryBuilder(info.sample_rate)
+            for block in streaming.decode_blocks(filepath, self.block_size, info.sample_rate, info.channels):
+                builder.process(block)
+            builder.save(path)
+            self.add_cached_file(path)
+        return peaks.read_level(path, view, width) + (path,)
+
+    def time_stages(self, chain, sample_rate):
+        # Wrap every stage of the chain so its time across all blocks is recorded
+        # under its metric name; repeated stage types are numbered (limiter, limiter_2)
+        counts = {}
+        timed_stages = []
+        for stage in chain.stages:
+            name = STAGES.get(type(stage), ('stage', ''))[0]
+            counts[name] = counts.get(name, 0) + 1
+            if counts[name] > 1:
+                name = f"{name}_{counts[name]}"
+            timed_stages.append(instrumentation.TimedProcessor(stage, name, sample_rate))
+        chain.stages = timed_stages
+        return timed_stages
+
+    def render_preview(self, filename, quality, audio_type, duration=30, sample_rate=22050, channels=1,
+                       reference=None, parallel_compression=False):
+        # Master a short, downsampled excerpt for A/B listening and return the clip filename
+        previews_folder = os.path.join(self.output_folder, PREVIEWS_FOLDER)
+        os.makedirs(previews_folder, exist_ok=True)
+
+        uploaded_filepath = os.path.join(self.upload_folder, filename)
+        params = self.mastering_params(quality, audio_type, reference, parallel_compression)
+        key = cache_key(uploaded_filepath, dict(params, preview=[duration, sample_rate, channels]))
+        preview_filename = f"preview_{key[:16]}.mp3"
+        preview_filepath = os.path.join(previews_folder, preview_filename)
+        if self.find_file('output', f"{PREVIEWS_FOLDER}/{preview_filename}") is not None:
+            return preview_filename
+
+        # Take the excerpt from a third of the way in, where most tracks are past the intro
+        info = streaming.probe(uploaded_filepath)
+        start = max(0.0, min(info.duration / 3, info.duration - duration))
+        samples, _ = streaming.read_audio(uploaded_filepath, sample_rate, channels, start=start, duration=duration)
+
+        # Use the whole-track measurement when mastering already made one, so the
+        # preview plays at the level of the final master; otherwise measure the excerpt
+        stats = None
+        if self.loudness_target is not None:
+            stats = self.cached_loudness(file_digest(uploaded_filepath)) or loudness.analyze_array(samples, sample_rate)
+
+        eq_taps = channel_power = None
+        if reference:
+            analyzer = eq_match.SpectrumAnalyzer(weights=loudness.channel_weights(channels))
+            analyzer.process(samples)
+            eq_taps = self.reference_eq_taps(analyzer.result(), reference, sample_rate)
+            channel_power = analyzer.channel_result()
+        gain_db = self.loudness_gain(stats, eq_taps, channel_power, sample_rate)
+
+        chain = self.build_mastering_chain(sample_rate, channels, gain_db, eq_taps=eq_taps,
+                                           parallel_compression=parallel_compression,
+                                           preset=self.load_preset(quality, audio_type))
+        with instrumentation.stage('preview_chain', len(samples) / sample_rate):
+            samples = dsp.run_whole(chain, samples)
+
+        with storage.atomic_write(preview_filepath) as temp_filepath:
+            with streaming.StreamEncoder(temp_filepath, sample_rate, channels, format='mp3', codec='libmp3lame',
+                                         parameters=['-b:a', '96k']) as encoder:
+                encoder.write(samples)
+        self.add_file('output', f"{PREVIEWS_FOLDER}/{preview_filename}")
+
+        return preview_filename
+
+    def play_preview(self, preview_filename):
+        preview_filepath = self.find_file('output', f"{PREVIEWS_FOLDER}/{preview_filename}")
+        if preview_filepath is None:
+            return "Preview not found", 404
+        return playback.stream_file(preview_filepath, 'audio/mpeg')
+
+    def rendition_name(self, output_filename, format):
+        return f"{delivery.RENDITIONS_FOLDER}/{output_filename}.{format}"
+
+    def rendition(self, output_filename, format):
+        # Path of a delivery transcode of a master, made on first use and indexed for eviction like the master
+        name = self.rendition_name(output_filename, format)
+        indexed = self.find_file('output', name) is not None
+        path = delivery.ensure_rendition(self.output_folder, output_filename, format)
+        if not indexed:
+            self.add_file('output', name)
+        return path
+
+    def analyze_input(self, uploaded_filepath, info, spectrum=False):
+        # Loudness stats (None without a loudness target) and, with spectrum, the
+        # mid and channel spectra for reference matching (else None). All are
+        # cached by file digest, and whatever is missing is measured in one
+        # shared decode pass.
+        digest = file_digest(uploaded_filepath)
+        stats = power = channel_power = meter = analyzer = None
+        if self.loudness_target is not None:
+            stats = self.cached_loudness(digest)
+            if stats is None:
+                meter = loudness.LoudnessMeter(info.sample_rate, info.channels)
+        if spectrum:
+            power = self.cached_spectrum(digest, info.sample_rate)
+            channel_power = self.cached_spectrum(digest, info.sample_rate, view='channels')
+            if power is None or channel_power is None:
+                analyzer = eq_match.SpectrumAnalyzer(weights=loudness.channel_weights(info.channels))
+
+        if meter is None and analyzer is None:
+            return stats, power, channel_power
+        for block in streaming.decode_blocks(uploaded_filepath, self.block_size, info.sample_rate, info.channels):
+            if meter is not None:
+                meter.process(block)
+            if analyzer is not None:
+                analyzer.process(block)
+        if meter is not None:
+            stats = meter.result()
+            self.store_loudness(digest, stats)
+        if analyzer is not None:
+            power, channel_power = analyzer.result(), analyzer.channel_result()
+            self.store_spectrum(digest, info.sample_rate, power)
+            self.store_spectrum(digest, info.sample_rate, channel_power, view='channels')
+        return stats, power, channel_power
+
+    def loudness_gain(self, stats, eq_taps=None, channel_power=None, sample_rate=None):
+        # Gain in dB to the loudness target. The input is measured before the
+        # reference EQ, which runs first in the chain, so the gain is corrected
+        # by the level change the EQ makes to the input's spectrum.
+        if self.loudness_target is None:
+            return 0.0
+        gain_db = loudness.normalization_gain(stats, self.loudness_target)
+        if eq_taps is not None:
+            gain_db -= eq_match.loudness_change(eq_taps, channel_power, sample_rate)
+        return gain_db
+
+    def reference_eq_taps(self, input_power, reference, sample_rate):
+        reference_power = self.file_spectrum(os.path.join(self.upload_folder, reference), sample_rate)
+        return eq_match.match_filter(input_power, reference_power, sample_rate)
+
+    def build_mastering_chain(self, sample_rate, channels, gain_db=0.0, eq_taps=None, parallel_compression=False,
+                              preset=None):
+        # The stages come from the preset (see presets/balanced.json for the
+        # default chain); the reference EQ and parallel compression are added
+        # in front of them when asked for
+        if preset is None:
+            preset = self.load_preset(None, None)
+        return presets.compile_chain(preset, sample_rate, channels, gain_db, eq_taps=eq_taps,
+                                     parallel_compression=parallel_compression)
 
-            # Use 24-bit export for higher quality
-            audio.export(output_filepath, format="wav", parameters=["-b:a", "24k"])
-            flash('Mastering completed', 'info')
+    def process_audio(self, file, quality, audio_type):
+        try:
+            filename = self.save_upload(file)
+            output_filename = self.master_file(filename, quality, audio_type,
+                                               progress=lambda fraction, message: self.notify(message, 'info'))
 
             # Set the mastering_completed flag to True
             mastering_completed = True
@@ -63,25 +447,21 @@ class AudioProcessor:
             return output_filename, mastering_completed
 
         except Exception as e:
-            flash(f'Error processing audio: {str(e)}', 'error')
-            return None, False
-
-        except Exception as e:
-            flash(f'Error processing audio: {str(e)}', 'error')
+            self.notify(f'Error processing audio: {str(e)}', 'error')
             return None, False
 
     def download_file(self, filename, format):
         try:
-            output_filepath = os.path.join(self.output_folder, filename)
-            if os.path.exists(output_filepath):
-                # Check the requested format and convert if necessary
-                if format == 'mp3':
-                    output_audio = AudioSegment.from_wav(output_filepath)
-                    mp3_output_filepath = os.path.join(self.output_folder, f"{filename.split('.')[0]}.mp3")
-                    output_audio.export(mp3_output_filepath, format="mp3")
-                    return send_file(mp3_output_filepath, as_attachment=True, download_name=f"{filename.split('.')[0]}.mp3")
-                elif format == 'wav':
-                    return send_file(output_filepath, as_attachment=True, download_name=filename)
+            output_filepath = self.find_file('output', filename)
+            if output_filepath is not None:
+                # Serve the WAV itself or a transcode rendered once and kept on disk
+                if format == 'wav':
+                    return delivery.send_static(output_filepath, download_name=filename, mimetype='audio/wav')
+                elif format in delivery.DELIVERY_FORMATS:
+                    rendition_filepath = self.rendition(filename, format)
+                    download_name = f"{os.path.splitext(filename)[0]}.{format}"
+                    return delivery.send_static(rendition_filepath, download_name=download_name,
+                                                mimetype=delivery.DELIVERY_FORMATS[format]['mimetype'])
                 else:
                     flash('Unsupported format', 'error')
                     return "Unsupported format", 400
@@ -95,10 +475,11 @@ class AudioProcessor:
 
     def play_original(self, filename):
         try:
-            original_filepath = os.path.join(self.upload_folder, filename)
-            if os.path.exists(original_filepath):
-                audio = AudioSegment.from_file(original_filepath)
-                return send_file(audio.export(format="wav"), as_attachment=True, download_name=filename)
+            original_filepath = self.find_file('uploads', filename)
+            if original_filepath is not None:
+                # Uploads are already browser-playable MP3 or WAV, so stream them as stored
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                return playback.stream_file(original_filepath, mimetype)
             else:
                 flash('Original file not found', 'error')
                 return "Original file not found", 404
@@ -109,10 +490,13 @@ class AudioProcessor:
 
     def play_mastered(self, filename):
         try:
-            mastered_filepath = os.path.join(self.output_folder, filename)
-            if os.path.exists(mastered_filepath):
-                audio = AudioSegment.from_file(mastered_filepath)
-                return send_file(audio.export(format="wav"), as_attachment=True, download_name=filename)
+            mastered_filepath = self.find_file('output', filename)
+            if mastered_filepath is not None:
+                # Prefer the compact cached preview encoding over the 24-bit master
+                if self.playback_format:
+                    preview_filepath = self.rendition(filename, self.playback_format)
+                    return playback.stream_file(preview_filepath, delivery.DELIVERY_FORMATS[self.playback_format]['mimetype'])
+                return playback.stream_file(mastered_filepath, 'audio/wav')
             else:
                 flash('Mastered file not found', 'error')
                 return "Mastered file not found", 404
@@ -121,104 +505,64 @@ class AudioProcessor:
             flash(f'Error playing mastered file: {str(e)}', 'error')
             return None
 
-    def pause_audio(self):
+    @instrumentation.timed_stage('high_pass_filter')
+    def apply_high_pass_filter(self, samples, sample_rate, cutoff_freq):
         try:
-            pygame.mixer.music.pause()
-            return 'Audio paused'
+            # Apply a Butterworth high-pass (SOS biquads) to the side channel
+            highpass = dsp.SideHighPass(sample_rate, samples.shape[1], cutoff_freq)
+            return dsp.run_whole(highpass, samples)
 
         except Exception as e:
-            flash(f'Error pausing audio: {str(e)}', 'error')
-            return None
+            self.notify(f'Error applying high-pass filter: {str(e)}', 'error')
+            return samples
 
-    def apply_high_pass_filter(self, audio, cutoff_freq):
+    @instrumentation.timed_stage('limiter')
+    def apply_limiter(self, samples, sample_rate, release_time, ceiling_db=-1.0):
         try:
-            # Apply high-pass filter using PyDub's high_pass_filter method
-            audio = audio.high_pass_filter(cutoff_freq)
-
-            return audio
+            # Apply a look-ahead peak limiter so the output never exceeds the ceiling
+            limiter = dsp.LookaheadLimiter(sample_rate, samples.shape[1], release_time=release_time, ceiling_db=ceiling_db)
+            return dsp.run_whole(limiter, samples)
 
         except Exception as e:
-            flash(f'Error applying high-pass filter: {str(e)}', 'error')
-            return audio
+            self.notify(f'Error applying limiter: {str(e)}', 'error')
+            return samples
 
-    def apply_limiter(self, audio, release_time):
+    @instrumentation.timed_stage('multiband_expander')
+    def apply_multiband_expander(self, samples, sample_rate):
         try:
-            # Apply a limiter effect by adjusting the volume
-            max_volume = audio.max_possible_amplitude
-            audio = audio - max_volume  # Reduce volume to avoid clipping
-
-            return audio
+            # Apply a multi-band expander for dynamic sound, split by a Linkwitz-Riley crossover bank
+            expander = dsp.MultibandExpander(sample_rate, samples.shape[1])
+            return dsp.run_whole(expander, samples)
 
         except Exception as e:
-            flash(f'Error applying limiter: {str(e)}', 'error')
-            return audio
+            self.notify(f'Error applying multi-band expander: {str(e)}', 'error')
+            return samples
 
-    def apply_multiband_expander(self, audio):
+    @instrumentation.timed_stage('reference_eq')
+    def eq_match_advanced(self, samples, sample_rate, reference_track):
         try:
-            # Apply a multi-band expander for dynamic sound (placeholder)
-            # In a professional setup, you would use dedicated plugins or tools for this
-            # This is a simplified example using PyDub
-            return audio  # Placeholder for multi-band expander logic
+            # Compare the Welch-averaged spectra of both tracks (the reference's is cached)
+            # and apply the smoothed difference as a minimum-phase FIR
+            reference_power = self.file_spectrum(reference_track, sample_rate)
+            taps = eq_match.match_filter(eq_match.average_spectrum(samples), reference_power, sample_rate)
+            return dsp.run_whole(dsp.FirFilter(taps, samples.shape[1]), samples)
 
         except Exception as e:
-            flash(f'Error applying multi-band expander: {str(e)}', 'error')
-            return audio
+            self.notify(f'Error applying advanced EQ matching: {str(e)}', 'error')
+            return samples
 
-    def eq_match_advanced(self, audio, reference_track):
+    @instrumentation.timed_stage('parallel_compression')
+    def advanced_parallel_compression(self, samples, sample_rate, compression_ratio=4.0, blend_factor=0.5):
         try:
-            # Load the reference track
-            reference_audio = AudioSegment.from_file(reference_track)
-
-            # Convert both audio tracks to numpy arrays for spectral analysis
-            audio_np = np.array(audio.get_array_of_samples())
-            reference_np = np.array(reference_audio.get_array_of_samples())
-
-            # Calculate the spectral envelope of both tracks
-            audio_envelope = pyo.FFT(audio_np).abs().smooth(0.01)
-            reference_envelope = pyo.FFT(reference_np).abs().smooth(0.01)
-
-            # Apply EQ matching by equalizing the audio based on the reference envelope
-            matched_audio = audio.apply_gain(reference_envelope / audio_envelope)
-
-            return matched_audio
+            # Blend heavy compression with the original in a single gain per sample
+            compressor = dsp.ParallelCompressor(sample_rate, samples.shape[1], blend=blend_factor, threshold_db=-18.0,
+                                                ratio=compression_ratio, attack_ms=10.0, release_ms=100.0)
+            return dsp.run_whole(compressor, samples)
 
         except Exception as e:
-            flash(f'Error applying advanced EQ matching: {str(e)}', 'error')
-            return audio
-
-    def advanced_parallel_compression(self, audio, compression_ratio=4.0, blend_factor=0.5):
-        try:
-            # Create a compressor with customizable settings
-            compressor = pyo.Compressor(threshold=-18, ratio=compression_ratio, attack=0.01, release=0.1)
-
-            # Apply heavy compression
-            compressed_audio = compressor(audio)
-
-            # Blend the compressed audio with the original
-            blended_audio = (audio * (1 - blend_factor)) + (compressed_audio * blend_factor)
-
-            return blended_audio
-
-        except Exception as e:
-            flash(f'Error applying advanced parallel compression: {str(e)}', 'error')
-            return audio
-
-    def advanced_adjust_limiter_release(self, audio, release_time_ms):
-        try:
-            # Convert release_time_ms to time in seconds
-            release_time_sec = release_time_ms / 1000.0
-
-            # Apply precise release time adjustment
-            audio = audio.fade_out(release_time_sec)
-
-            return audio
-
-        except Exception as e:
-            flash(f'Error applying advanced limiter release adjustment: {str(e)}', 'error')
-            return audio
-
-app = Flask(__name__)
-app.config.from_object("config")
+            self.notify(f'Error applying advanced parallel compression: {str(e)}', 'error')
+            return samples
 
-if __name__ == '__main__':
-    app.run(debug=True)
+    def advanced_adjust_limiter_release(self, samples, sample_rate, release_time_ms, ceiling_db=-1.0):
+        # The release is a property of the look-ahead limiter, so run it with the requested release time
+        return self.apply_limiter(samples, sample_rate, release_time_ms, ceiling_db=ceiling_db)
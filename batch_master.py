@@ -0,0 +1,180 @@
+# batch_master.py
+"""Headless batch mastering with the advanced (desktop) mastering chain.
+
+Usage:
+    python batch_master.py INPUT_DIR_OR_MANIFEST OUTPUT_DIR [--workers N] [--report PATH]
+
+INPUT may be a directory (every .wav/.mp3 below it is mastered) or a
+manifest: a .json list of paths or {"input": ..., "output": ...} objects,
+or a text file with one input path per line. Outputs that already exist and
+read back as valid audio are skipped, so an interrupted batch can simply be
+run again.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3')
+
+
+def collect_jobs(source, output_dir):
+    # Return (input_path, output_path) pairs from a directory or a manifest
+    if os.path.isdir(source):
+        inputs = []
+        for root, _, files in os.walk(source):
+            inputs.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(AUDIO_EXTENSIONS))
+        return [(path, _output_path(output_dir, os.path.relpath(path, source))) for path in sorted(inputs)]
+
+    base = os.path.dirname(os.path.abspath(source))
+    if source.lower().endswith('.json'):
+        with open(source) as f:
+            entries = json.load(f)
+    else:
+        with open(source) as f:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+    jobs = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            input_path = os.path.join(base, entry['input'])
+            output_path = os.path.join(output_dir, entry['output']) if 'output' in entry else \
+                _output_path(output_dir, os.path.basename(input_path))
+        else:
+            input_path = os.path.join(base, entry)
+            output_path = _output_path(output_dir, os.path.basename(input_path))
+        jobs.append((input_path, output_path))
+    return jobs
+
+
+def _output_path(output_dir, relative_path):
+    return os.path.join(output_dir, os.path.splitext(relative_path)[0] + '_mastered.wav')
+
+
+def is_valid_output(path):
+    # Outputs are renamed into place only once fully written, but check the
+    # file really decodes before trusting it on resume
+    import soundfile as sf
+
+    try:
+        return sf.info(path).frames > 0
+    except Exception:
+        return False
+
+
+def master_one(input_path, output_path):
+    # Runs in a pool worker; imports stay here so the parent never loads TensorFlow
+    import soundfile as sf
+    import advanced_mastering
+    import instrumentation
+    import storage
+
+    started = time.perf_counter()
+    trace = instrumentation.Trace(input_path)
+    with trace.activate():
+        with instrumentation.stage('load') as timing:
+            audio, sr = sf.read(input_path)
+            timing['audio_seconds'] = len(audio) / sr
+        processed_audio = advanced_mastering.apply_advanced_processing(audio, sr)
+
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with instrumentation.stage('save', len(audio) / sr), storage.atomic_write(output_path) as temp_path:
+            # The temporary name has no audio extension, so the format comes from the destination
+            sf.write(temp_path, processed_audio, sr, format=os.path.splitext(output_path)[1][1:] or 'WAV')
+
+    trace = trace.to_dict()
+    return {'duration': len(audio) / sr, 'elapsed': time.perf_counter() - started,
+            'peak_rss_bytes': trace['peak_rss_bytes'], 'stages': trace['stages']}
+
+
+def warm_up_worker():
+    import separation
+
+    separation.warm_up()
+
+
+def run_batch(jobs, workers, report_path=None, log=print):
+    started = time.perf_counter()
+    results = []
+    pending = []
+    for input_path, output_path in jobs:
+        if is_valid_output(output_path):
+            results.append({'input': input_path, 'output': output_path, 'status': 'skipped'})
+        else:
+            pending.append((input_path, output_path))
+
+    total = len(jobs)
+    done = len(results)
+    if done:
+        log(f"Skipping {done} file(s) with existing output")
+
+    # Spawned workers do not inherit the parent's state, which TensorFlow does not survive.
+    # Each worker loads the separation model once, up front, and reuses it for every file.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=warm_up_worker) as executor:
+        futures = {executor.submit(master_one, input_path, output_path): (input_path, output_path)
+                   for input_path, output_path in pending}
+        for future in as_completed(futures):
+            input_path, output_path = futures[future]
+            done += 1
+            try:
+                stats = future.result()
+            except Exception as e:
+                results.append({'input': input_path, 'output': output_path, 'status': 'failed', 'error': str(e)})
+                log(f"[{done}/{total}] FAILED {input_path}: {e}")
+                continue
+
+            results.append(dict(stats, input=input_path, output=output_path, status='mastered'))
+            log(f"[{done}/{total}] {input_path} -> {output_path} "
+                f"({stats['duration']:.1f} s of audio in {stats['elapsed']:.1f} s)")
+
+    wall_time = time.perf_counter() - started
+    mastered = [result for result in results if result['status'] == 'mastered']
+    audio_seconds = sum(result['duration'] for result in mastered)
+    summary = {
+        'total': total,
+        'mastered': len(mastered),
+        'skipped': sum(1 for result in results if result['status'] == 'skipped'),
+        'failed': sum(1 for result in results if result['status'] == 'failed'),
+        'workers': workers,
+        'wall_time': wall_time,
+        'audio_seconds': audio_seconds,
+        'tracks_per_minute': len(mastered) / wall_time * 60 if wall_time else 0.0,
+        'audio_seconds_per_second': audio_seconds / wall_time if wall_time else 0.0,
+        'files': results,
+    }
+
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    log(f"Mastered {summary['mastered']}, skipped {summary['skipped']}, failed {summary['failed']} "
+        f"in {wall_time:.1f} s: {summary['tracks_per_minute']:.2f} tracks/minute, "
+        f"{summary['audio_seconds_per_second']:.2f} audio-seconds/second")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Master a directory or manifest of tracks on every core.")
+    parser.add_argument('source', help="directory of audio files, or a .json / text manifest")
+    parser.add_argument('output_dir', help="directory for mastered WAV files")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes (default: one per core)")
+    parser.add_argument('--report', help="summary report path (default: OUTPUT_DIR/batch_report.json)")
+    args = parser.parse_args(argv)
+
+    jobs = collect_jobs(args.source, args.output_dir)
+    if not jobs:
+        print("No audio files found", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    report_path = args.report or os.path.join(args.output_dir, 'batch_report.json')
+    summary = run_batch(jobs, args.workers, report_path)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
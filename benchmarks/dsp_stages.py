@@ -0,0 +1,242 @@
+# benchmarks/dsp_stages.py
+"""Measure throughput and peak memory of the mastering stages.
+
+Usage:
+    python benchmarks/dsp_stages.py [--durations 5 30] [--sample-rates 44100 96000]
+                                    [--channels 1 2] [--repeat N]
+                                    [--baseline PATH] [--update-baseline]
+                                    [--tolerance 0.25] [--memory-tolerance 0.10]
+
+Every signal is synthesised here from a fixed seed (pink noise, a bass line
+and drum-like transients at a typical mix level), so nothing is downloaded
+and each run processes the same audio. For every duration, sample rate and
+channel count the script times each AudioProcessor stage on the whole signal,
+the loudness measurement, and the full mastering chain as the streaming path
+runs it: loudness analysis, then the chain block by block.
+
+Every case first runs once untimed, so one-off setup (filter design, the
+cached reference spectrum, first-touch allocations) stays out of the
+timings. Throughput is the median, over --repeat runs, of seconds of audio
+processed per second. Peak memory is the largest traced allocation above the input
+signal during one extra run, measured with tracemalloc (which sees NumPy
+buffers) so it does not depend on what else the process has touched.
+
+Results are compared with the baseline file. A case is a regression when its
+throughput drops by more than --tolerance or its peak memory grows by more
+than --memory-tolerance, and the script then exits with status 1.
+
+The throughput figures in the stored baseline are absolute and only hold on
+the machine that recorded them (dsp_baseline.json was recorded on a
+development box). On any other machine, CI runner included, record a
+baseline there with --update-baseline before relying on the check; peak
+memory is far less machine dependent.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import dsp
+import eq_match
+import loudness
+from audio_processor import AudioProcessor
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dsp_baseline.json')
+SEED = 1234
+LOUDNESS_TARGET = -14.0
+
+
+def pink_noise(rng, frames, channels):
+    # White noise shaped to a -3 dB/octave spectral tilt in the frequency domain
+    white = rng.standard_normal((frames, channels))
+    spectrum = np.fft.rfft(white, axis=0)
+    spectrum[1:] /= np.sqrt(np.arange(1, len(spectrum)))[:, None]
+    spectrum[0] = 0.0
+    noise = np.fft.irfft(spectrum, n=frames, axis=0)
+    return noise / np.max(np.abs(noise))
+
+
+def synth_signal(duration, sample_rate, channels, seed=SEED):
+    # A mix-like test signal: pink noise bed, a bass line and kick-like transients
+    rng = np.random.default_rng(seed)
+    frames = int(duration * sample_rate)
+    t = np.arange(frames) / sample_rate
+
+    signal = 0.3 * pink_noise(rng, frames, channels)
+    bass = 0.4 * np.sin(2 * np.pi * 55.0 * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 0.5 * t))
+    signal += bass[:, None]
+
+    # One transient per beat at 120 BPM, a decaying 60 Hz burst
+    beat = int(0.5 * sample_rate)
+    decay = int(0.15 * sample_rate)
+    kick = np.sin(2 * np.pi * 60.0 * np.arange(decay) / sample_rate) * np.exp(-np.arange(decay) / (0.03 * sample_rate))
+    for start in range(0, frames - decay, beat):
+        signal[start:start + decay] += 0.5 * kick[:, None]
+
+    # Decorrelate the channels a little so mid/side stages have a side signal to work on
+    if channels > 1:
+        signal[:, 1:] = 0.9 * signal[:, 1:] + 0.1 * pink_noise(rng, frames, channels - 1)
+    return (0.5 * signal / np.max(np.abs(signal))).astype(np.float32)
+
+
+def stage_cases(processor, reference_power):
+    # name -> function(samples, sample_rate) running one stage on the whole signal
+    def reference_eq(samples, sample_rate):
+        taps = eq_match.match_filter(eq_match.average_spectrum(samples), reference_power(sample_rate), sample_rate)
+        return dsp.run_whole(dsp.FirFilter(taps, samples.shape[1]), samples)
+
+    def full_chain(samples, sample_rate):
+        # What render_master does between decode and encode in streaming mode
+        stats = loudness.analyze_array(samples, sample_rate, processor.block_size)
+        chain = processor.build_mastering_chain(sample_rate, samples.shape[1],
+                                                loudness.normalization_gain(stats, LOUDNESS_TARGET))
+        output = [chain.process(samples[start:start + processor.block_size])
+                  for start in range(0, len(samples), processor.block_size)]
+        output.append(chain.flush())
+        return np.concatenate(output)[chain.latency:]
+
+    return {
+        'high_pass_filter': lambda samples, sr: processor.apply_high_pass_filter(samples, sr, 130),
+        'limiter': lambda samples, sr: processor.apply_limiter(samples, sr, 100),
+        'multiband_expander': processor.apply_multiband_expander,
+        'parallel_compression': processor.advanced_parallel_compression,
+        'reference_eq': reference_eq,
+        'loudness_analysis': lambda samples, sr: loudness.analyze_array(samples, sr, processor.block_size),
+        'full_chain': full_chain,
+    }
+
+
+def measure(function, samples, sample_rate, repeat):
+    # Untimed warm-up run for one-off setup costs
+    function(samples, sample_rate)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(samples, sample_rate)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function(samples, sample_rate)
+        peak = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    seconds = statistics.median(timings)
+    return {
+        'seconds': seconds,
+        'audio_seconds_per_second': len(samples) / sample_rate / seconds,
+        'peak_memory_bytes': peak,
+    }
+
+
+def run(durations, sample_rates, channel_counts, repeat, stages=None, log=print):
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        processor = AudioProcessor(folder, folder)
+
+        # The reference track for the EQ match is another synthetic signal with a brighter tilt
+        reference_spectra = {}
+
+        def reference_power(sample_rate):
+            if sample_rate not in reference_spectra:
+                reference = synth_signal(10, sample_rate, 1, seed=SEED + 1)
+                reference = dsp.run_whole(dsp.SosFilter(dsp.biquad_sos('high_shelf', 4000, sample_rate, 6.0), 1), reference)
+                reference_spectra[sample_rate] = eq_match.average_spectrum(reference)
+            return reference_spectra[sample_rate]
+
+        cases = stage_cases(processor, reference_power)
+        for duration in durations:
+            for sample_rate in sample_rates:
+                for channels in channel_counts:
+                    samples = synth_signal(duration, sample_rate, channels)
+                    for name, function in cases.items():
+                        if stages and name not in stages:
+                            continue
+                        key = f"{name}/{duration:g}s/{sample_rate}Hz/{channels}ch"
+                        results[key] = measure(function, samples, sample_rate, repeat)
+                        log(f"{key:<48} {results[key]['audio_seconds_per_second']:9.1f} x realtime "
+                            f"{results[key]['peak_memory_bytes'] / 2 ** 20:8.1f} MiB peak")
+    return results
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    # Return a list of regression messages, one per case and metric
+    regressions = []
+    for key, result in sorted(results.items()):
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        slowest = expected['audio_seconds_per_second'] * (1 - tolerance)
+        if result['audio_seconds_per_second'] < slowest:
+            regressions.append(f"{key}: {result['audio_seconds_per_second']:.1f} x realtime, "
+                               f"baseline {expected['audio_seconds_per_second']:.1f}")
+        # Growth of less than 1 MiB is allocator noise on the short cases, not a regression
+        largest = expected['peak_memory_bytes'] * (1 + memory_tolerance)
+        if result['peak_memory_bytes'] > max(largest, 2 ** 20):
+            regressions.append(f"{key}: {result['peak_memory_bytes'] / 2 ** 20:.1f} MiB peak, "
+                               f"baseline {expected['peak_memory_bytes'] / 2 ** 20:.1f} MiB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the mastering stages on synthetic signals.")
+    parser.add_argument('--durations', type=float, nargs='+', default=[5, 30], help="signal lengths in seconds")
+    parser.add_argument('--sample-rates', type=int, nargs='+', default=[44100, 96000])
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--stages', nargs='+', help="only run these stages (default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per case, at least 3 (default: 3)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument('--update-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed throughput drop (default: 0.25)")
+    parser.add_argument('--memory-tolerance', type=float, default=0.10, help="allowed peak memory growth (default: 0.10)")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    if args.repeat < 3:
+        parser.error("--repeat must be at least 3; the median of fewer runs is too noisy to compare")
+
+    results = run(args.durations, args.sample_rates, args.channels, args.repeat, args.stages)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one", file=sys.stderr)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    missing = [key for key in results if key not in baseline]
+    if missing:
+        print(f"{len(missing)} case(s) have no baseline yet", file=sys.stderr)
+
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}", file=sys.stderr)
+    print(f"{len(results) - len(missing)} case(s) compared, {len(regressions)} regression(s)")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+# benchmarks/startup.py
+"""Measure how long a web worker takes to start.
+
+Usage:
+    python benchmarks/startup.py [--repeat N]
+
+Every measurement runs in a fresh interpreter, so nothing is shared between
+runs. Three cases are timed:
+
+    lazy       create_app() as a worker normally starts; no NumPy or SciPy
+    preloaded  create_app(preload_dsp=True), what a pre-fork master pays once
+    first use  the lazy start plus building the audio processor, i.e. the
+               extra cost the first audio request pays in a lazy worker
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'lazy': "app.create_app(preload_dsp=False)",
+    'preloaded': "app.create_app(preload_dsp=True)",
+    'first use': "created = app.create_app(preload_dsp=False)\n"
+                 "with created.app_context():\n"
+                 "    app.services().audio_processor",
+}
+
+SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import app
+{code}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'numpy_loaded': 'numpy' in sys.modules, 'modules': len(sys.modules)}}))
+"""
+
+
+def measure(code):
+    # Run from the repository root, where the app finds config.py and its folders
+    output = subprocess.run([sys.executable, '-c', SCRIPT.format(code=code)], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time web worker startup with lazy and preloaded DSP imports.")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters per case (default: 5)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, code in CASES.items():
+        runs = [measure(code) for _ in range(args.repeat)]
+        results[name] = {
+            'median_seconds': statistics.median(run['seconds'] for run in runs),
+            'numpy_loaded': runs[-1]['numpy_loaded'],
+            'modules': runs[-1]['modules'],
+        }
+        print(f"{name:>10}: {results[name]['median_seconds'] * 1000:8.1f} ms median of {args.repeat}, "
+              f"{results[name]['modules']} modules, NumPy {'loaded' if results[name]['numpy_loaded'] else 'not loaded'}")
+
+    saved = results['preloaded']['median_seconds'] - results['lazy']['median_seconds']
+    print(f"Lazy imports save {saved * 1000:.1f} ms per worker start")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
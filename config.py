@@ -7,6 +7,70 @@ OUTPUT_FOLDER = 'output'
 SECRET_KEY = 'your_secret_key'
 ALLOWED_EXTENSIONS = {'mp3', 'wav'}
 
+# Reviews
+REVIEWS_DATABASE = 'reviews.db'
+REVIEWS_PER_PAGE = 20
+MAX_REVIEWS_PER_PAGE = 100
+
+# Submitted reviews are committed in batches of up to REVIEW_BATCH_SIZE, at least every REVIEW_FLUSH_INTERVAL seconds.
+# REVIEW_DURABILITY is 'sync' (one commit per review), 'group' (the request waits for its batch to commit)
+# or 'async' (the request returns once the review is buffered).
+REVIEW_BATCH_SIZE = 100
+REVIEW_FLUSH_INTERVAL = 0.05
+REVIEW_DURABILITY = 'group'
+REVIEWS_CACHE_TTL = 5.0  # seconds before reviews committed by other server processes show up
+
+# Mastering job queue
+JOBS_DATABASE = 'jobs.db'
+# Every web server process runs its own pool, so the CPUs are split between them: under gunicorn set
+# WEB_CONCURRENCY (which gunicorn also reads as its worker count) or MASTERING_WORKERS per process,
+# otherwise N server processes start N x cpu_count mastering workers.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+MASTERING_WORKERS = int(os.environ.get('MASTERING_WORKERS', 0)) \
+    or max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)  # Size of each process's mastering pool
+MAX_QUEUED_JOBS = 32  # Uploads are rejected with 503 once this many jobs are waiting or running
+
+# Streaming mastering keeps memory constant by processing fixed-size blocks
+STREAMING_MASTERING = True
+STREAMING_BLOCK_SIZE = 65536  # frames per block
+
+# Mastered renders are cached by audio hash and settings; least recently used renders are evicted past this size
+RENDER_CACHE_SIZE = 2 * 1024 ** 3  # bytes, 0 disables the cache
+
+# Delivery formats transcoded when mastering finishes; others are transcoded on first download
+PRERENDER_FORMATS = ['mp3']
+
+# Encoding streamed to the browser player for mastered files (None streams the WAV itself)
+PLAYBACK_FORMAT = 'mp3'
+
+# Preview renders master a short mono excerpt at a low sample rate
+PREVIEW_DURATION = 30  # seconds
+PREVIEW_SAMPLE_RATE = 22050
+
+# Uploads are gained to this integrated loudness before limiting (None leaves the level alone)
+LOUDNESS_TARGET = -14.0  # LUFS
+
+# Resumable chunked uploads (/uploads): largest accepted file and largest single part
+MAX_UPLOAD_SIZE = 1024 ** 3  # bytes
+MAX_UPLOAD_CHUNK_SIZE = 8 * 1024 ** 2  # bytes
+UPLOAD_LIVE_IDLE_TIMEOUT = 300  # seconds without a part before an upload's loudness decoder is stopped
+
+# Disk lifecycle of the upload and output folders: an index of every stored file, swept in the background.
+# Files unused for STORAGE_MAX_AGE are removed, then least recently used ones while the folders exceed
+# STORAGE_MAX_BYTES. Files used in the last STORAGE_MIN_AGE, or needed by a queued or running job, are kept.
+STORAGE_DATABASE = 'storage.db'
+STORAGE_MAX_BYTES = 20 * 1024 ** 3  # bytes, 0 disables the size quota
+STORAGE_MAX_AGE = 7 * 24 * 3600  # seconds, None disables the age limit
+STORAGE_MIN_AGE = 15 * 60  # seconds
+STORAGE_SWEEP_INTERVAL = 60  # seconds
+
+# Save a JSON trace of per-stage timings for every mastering job (served at /job_trace/<job_id>)
+SAVE_JOB_TRACES = False
+
+# Import NumPy, SciPy and the DSP modules in create_app() instead of on the first request that needs them;
+# enable for pre-fork servers so the workers share the imports
+PRELOAD_DSP = False
+
 # Create a list to store reviews
 reviews_list = []
 
@@ -0,0 +1,81 @@
+# database.py
+import os
+import sqlite3
+import threading
+from dbbcreate import create_schema
+
+# Reviews data access. Each thread keeps one open connection, configured for
+# WAL journaling so page reads never wait on a writer. The SQL below is kept
+# as constant strings so sqlite3's per-connection statement cache reuses the
+# compiled statements on every request.
+
+# Keyset pagination: a page starts strictly after the (timestamp, id) of the cursor row
+SELECT_FIRST_PAGE = '''
+    SELECT id, author, content, timestamp FROM reviews
+    ORDER BY timestamp DESC, id DESC LIMIT ?
+'''
+SELECT_PAGE_BEFORE = '''
+    SELECT id, author, content, timestamp FROM reviews
+    WHERE (timestamp, id) < (SELECT timestamp, id FROM reviews WHERE id = ?)
+    ORDER BY timestamp DESC, id DESC LIMIT ?
+'''
+INSERT_REVIEW = 'INSERT INTO reviews (author, content) VALUES (?, ?)'
+
+BUSY_TIMEOUT_MS = 5000
+
+_local = threading.local()
+_database_path = 'reviews.db'
+
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=64)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    # In WAL mode NORMAL only gives up durability of the last commits on power loss, never consistency
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def init_db(path):
+    # Run once at startup: remember the database and make sure the schema exists
+    global _database_path
+    _database_path = path
+    conn = _open(path)
+    try:
+        create_schema(conn)
+    finally:
+        conn.close()
+
+
+def get_connection():
+    # Connections are not shared across threads or forked processes
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid() or _local.path != _database_path:
+        conn = _open(_database_path)
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.path = _database_path
+    return conn
+
+
+def fetch_reviews_page(limit, before=None):
+    # Return up to limit rows (newest first) and the cursor for the next page
+    conn = get_connection()
+    if before is None:
+        rows = conn.execute(SELECT_FIRST_PAGE, (limit + 1,)).fetchall()
+    else:
+        rows = conn.execute(SELECT_PAGE_BEFORE, (before, limit + 1)).fetchall()
+
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def insert_review(author, content):
+    insert_reviews([(author, content)])
+
+
+def insert_reviews(rows):
+    # Insert many reviews in one transaction, i.e. one commit and one fsync
+    conn = get_connection()
+    with conn:
+        conn.executemany(INSERT_REVIEW, rows)
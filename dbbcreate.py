@@ -1,19 +1,32 @@
 import sqlite3
 
-# Create a connection to the database (this will create a new database file if it doesn't exist)
-conn = sqlite3.connect('reviews.db')
-cursor = conn.cursor()
-
 # Define the schema for the reviews table
-cursor.execute('''
+SCHEMA = '''
     CREATE TABLE IF NOT EXISTS reviews (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         author TEXT NOT NULL,
         content TEXT NOT NULL,
         timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
-''')
+'''
+
+# Newest-first pages are read straight from this index
+INDEXES = '''
+    CREATE INDEX IF NOT EXISTS reviews_timestamp_id ON reviews (timestamp, id)
+'''
+
+
+def create_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute(SCHEMA)
+    cursor.execute(INDEXES)
+    conn.commit()
+
+
+if __name__ == '__main__':
+    # Create a connection to the database (this will create a new database file if it doesn't exist)
+    conn = sqlite3.connect('reviews.db')
+    create_schema(conn)
 
-# Commit the changes and close the connection
-conn.commit()
-conn.close()
+    # Close the connection
+    conn.close()
@@ -0,0 +1,66 @@
+# delivery.py
+import os
+import subprocess
+from flask import send_file
+from pydub.utils import get_encoder_name
+import storage
+
+# Delivery renditions of a mastered WAV are transcoded once and kept on disk
+# under output/renditions/<mastered filename>.<format>, so downloads are
+# plain static file responses with ETag, Last-Modified and Range support.
+
+RENDITIONS_FOLDER = 'renditions'
+
+DELIVERY_FORMATS = {
+    'mp3': {'codec': 'libmp3lame', 'parameters': ['-b:a', '320k'], 'mimetype': 'audio/mpeg'},
+    'flac': {'codec': 'flac', 'parameters': [], 'mimetype': 'audio/flac'},
+    'ogg': {'codec': 'libvorbis', 'parameters': ['-q:a', '8'], 'mimetype': 'audio/ogg'},
+}
+
+
+def rendition_path(output_folder, filename, format):
+    return os.path.join(output_folder, RENDITIONS_FOLDER, f"{filename}.{format}")
+
+
+def is_fresh(path, source_path):
+    # A rendition is stale if the mastered file was rewritten after it was made
+    try:
+        return os.path.getmtime(path) >= os.path.getmtime(source_path)
+    except OSError:
+        return False
+
+
+def transcode(source_path, path, format):
+    settings = DELIVERY_FORMATS[format]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Encode to a private temporary name and rename into place, so concurrent
+    # requests never see or serve a half-written file
+    with storage.atomic_write(path) as temp_path:
+        command = [get_encoder_name(), '-v', 'error', '-nostdin', '-y', '-i', source_path,
+                   '-acodec', settings['codec']] + settings['parameters'] + ['-f', format, temp_path]
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f'Transcoding to {format} failed: {result.stderr.decode(errors="replace").strip()}')
+
+
+def ensure_rendition(output_folder, filename, format):
+    source_path = os.path.join(output_folder, filename)
+    path = rendition_path(output_folder, filename, format)
+    if not is_fresh(path, source_path):
+        transcode(source_path, path, format)
+    return path
+
+
+def remove_renditions(output_folder, filename):
+    for format in DELIVERY_FORMATS:
+        try:
+            os.remove(rendition_path(output_folder, filename, format))
+        except FileNotFoundError:
+            pass
+
+
+def send_static(path, download_name, mimetype=None, max_age=3600):
+    # send_file with a path answers If-None-Match, If-Modified-Since and Range itself
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name,
+                     conditional=True, etag=True, last_modified=os.path.getmtime(path), max_age=max_age)
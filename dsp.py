@@ -0,0 +1,358 @@
+# dsp.py
+import numpy as np
+from scipy import signal
+
+# Every processor works on float32 arrays shaped (samples, channels) in the
+# range [-1, 1). Processors are stateful: feeding a signal in consecutive
+# blocks gives the same result as feeding it in one call. A processor with a
+# non-zero ``latency`` delays its output by that many samples and releases the
+# tail on ``flush()``.
+
+
+def run_whole(processor, samples):
+    # Process a complete signal and compensate the processor's latency
+    head = processor.process(samples)
+    tail = processor.flush()
+    return np.concatenate([head, tail])[processor.latency:]
+
+
+def _sliding_reduce(x, width, op):
+    # out[i] = op(x[i:i + width]) built from power-of-two partial reductions.
+    # Each output is reduced in the same order wherever the block boundaries
+    # fall, so block-wise processing is bit-identical to one-shot processing.
+    count = len(x) - width + 1
+    result = None
+    offset = 0
+    span = 1
+    level = x
+    remaining = width
+    while True:
+        if remaining & 1:
+            part = level[offset:offset + count]
+            result = part if result is None else op(result, part)
+            offset += span
+        remaining >>= 1
+        if not remaining:
+            return result
+        level = op(level[:-span], level[span:])
+        span *= 2
+
+
+class SosFilter:
+    def __init__(self, sos, channels):
+        self.sos = np.asarray(sos, dtype=np.float32)
+        self.zi = np.zeros((self.sos.shape[0], 2, channels), dtype=np.float32)
+        self.latency = 0
+
+    def process(self, block):
+        out, self.zi = signal.sosfilt(self.sos, block, axis=0, zi=self.zi)
+        return out
+
+    def flush(self):
+        return np.zeros((0, self.zi.shape[2]), dtype=np.float32)
+
+
+def butter_sos(order, cutoff_freq, btype, sample_rate):
+    return signal.butter(order, cutoff_freq, btype=btype, fs=sample_rate, output='sos')
+
+
+def linkwitz_riley_sos(cutoff_freq, btype, sample_rate):
+    # 4th-order Linkwitz-Riley: two cascaded 2nd-order Butterworth sections
+    sos = butter_sos(2, cutoff_freq, btype, sample_rate)
+    return np.concatenate([sos, sos])
+
+
+def allpass_sos(cutoff_freq, sample_rate):
+    # The LR4 low and high outputs sum to this 2nd-order allpass
+    a = butter_sos(2, cutoff_freq, 'lowpass', sample_rate)[0, 3:]
+    return np.array([[a[2], a[1], a[0], a[0], a[1], a[2]]])
+
+
+def biquad_sos(kind, freq, sample_rate, gain_db=0.0, q=0.7071):
+    # RBJ audio EQ cookbook biquads as a single SOS row
+    a_gain = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * freq / sample_rate
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+
+    if kind == 'peaking':
+        b = [1 + alpha * a_gain, -2 * cos_w0, 1 - alpha * a_gain]
+        a = [1 + alpha / a_gain, -2 * cos_w0, 1 - alpha / a_gain]
+    elif kind in ('low_shelf', 'high_shelf'):
+        sign = 1 if kind == 'low_shelf' else -1
+        root = 2 * np.sqrt(a_gain) * alpha
+        b = [a_gain * ((a_gain + 1) - sign * (a_gain - 1) * cos_w0 + root),
+             sign * 2 * a_gain * ((a_gain - 1) - sign * (a_gain + 1) * cos_w0),
+             a_gain * ((a_gain + 1) - sign * (a_gain - 1) * cos_w0 - root)]
+        a = [(a_gain + 1) + sign * (a_gain - 1) * cos_w0 + root,
+             -sign * 2 * ((a_gain - 1) + sign * (a_gain + 1) * cos_w0),
+             (a_gain + 1) + sign * (a_gain - 1) * cos_w0 - root]
+    elif kind == 'highpass':
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    elif kind == 'lowpass':
+        b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    else:
+        raise ValueError(f"Unknown filter type: {kind}")
+
+    return np.array([b + a]) / a[0]
+
+
+class ParametricEQ(SosFilter):
+    """Cascade of cookbook biquads, e.g. bands=[{'type': 'peaking', 'freq': 3000, 'gain_db': 2, 'q': 1}]."""
+
+    def __init__(self, sample_rate, channels, bands):
+        sos = [biquad_sos(band['type'], band['freq'], sample_rate, band.get('gain_db', 0.0), band.get('q', 0.7071))
+               for band in bands]
+        super().__init__(np.concatenate(sos) if sos else np.array([[1.0, 0, 0, 1.0, 0, 0]]), channels)
+
+
+class FirFilter:
+    """FIR filter applied by FFT overlap-add; each block's convolution tail carries into the next."""
+
+    def __init__(self, taps, channels):
+        self.taps = np.asarray(taps, dtype=np.float32)[:, None]
+        self.tail = np.zeros((len(self.taps) - 1, channels), dtype=np.float32)
+        self.latency = 0
+
+    def process(self, block):
+        if len(block) == 0:
+            return block
+        out = signal.oaconvolve(block, self.taps, axes=0).astype(np.float32)
+        out[:len(self.tail)] += self.tail
+        self.tail = out[len(block):]
+        return out[:len(block)]
+
+    def flush(self):
+        return np.zeros((0, self.tail.shape[1]), dtype=np.float32)
+
+
+class Compressor:
+    """Feed-forward downward compressor with a vectorized gain computer.
+
+    The level detector and the gain smoothing are one-pole filters, so the
+    whole block is processed with two lfilter calls instead of a per-sample
+    attack/release loop.
+    """
+
+    def __init__(self, sample_rate, channels, threshold_db=-18.0, ratio=4.0, attack_ms=10.0, release_ms=100.0,
+                 makeup_db=0.0):
+        self.channels = channels
+        self.latency = 0
+        self.threshold_db = threshold_db
+        self.ratio = ratio
+        self.makeup = np.float32(10 ** (makeup_db / 20))
+
+        release = np.exp(-1.0 / max(release_ms / 1000 * sample_rate, 1.0))
+        attack = np.exp(-1.0 / max(attack_ms / 1000 * sample_rate, 1.0))
+        self._detector_b = np.array([1 - release], dtype=np.float32)
+        self._detector_a = np.array([1, -release], dtype=np.float32)
+        self._detector_zi = np.zeros(1, dtype=np.float32)
+        self._smooth_b = np.array([1 - attack], dtype=np.float32)
+        self._smooth_a = np.array([1, -attack], dtype=np.float32)
+        self._smooth_zi = np.zeros(1, dtype=np.float32)
+
+    def gain(self, block):
+        # Linear gain per sample for a block, advancing the detector state
+        peak = np.max(np.abs(block), axis=1)
+        level, self._detector_zi = signal.lfilter(self._detector_b, self._detector_a, peak, zi=self._detector_zi)
+        level_db = 20 * np.log10(np.maximum(np.maximum(level, peak), np.float32(1e-9)))
+        reduction_db = np.minimum(np.float32(0), (self.threshold_db - level_db) * np.float32(1 - 1 / self.ratio))
+        reduction_db, self._smooth_zi = signal.lfilter(self._smooth_b, self._smooth_a, reduction_db, zi=self._smooth_zi)
+        return (10 ** (reduction_db / 20)).astype(np.float32) * self.makeup
+
+    def process(self, block):
+        return block * self.gain(block)[:, None]
+
+    def flush(self):
+        return np.zeros((0, self.channels), dtype=np.float32)
+
+
+class ParallelCompressor:
+    """Blend of the dry signal with a compressed copy.
+
+    Both paths share the same samples, so the mix reduces to one per-sample
+    gain: dry * (1 - blend) + dry * compressor_gain * blend.
+    """
+
+    def __init__(self, sample_rate, channels, blend=0.5, **compressor_options):
+        self.compressor = Compressor(sample_rate, channels, **compressor_options)
+        self.channels = channels
+        self.latency = 0
+        self.blend = np.float32(blend)
+
+    def process(self, block):
+        gain = (np.float32(1) - self.blend) + self.blend * self.compressor.gain(block)
+        return block * gain[:, None]
+
+    def flush(self):
+        return np.zeros((0, self.channels), dtype=np.float32)
+
+
+class Gain:
+    def __init__(self, sample_rate, channels, gain_db=0.0):
+        self.channels = channels
+        self.latency = 0
+        self.gain = np.float32(10 ** (gain_db / 20))
+
+    def process(self, block):
+        return block * self.gain
+
+    def flush(self):
+        return np.zeros((0, self.channels), dtype=np.float32)
+
+
+class SideHighPass:
+    """High-pass the side signal so that low frequencies collapse to mono."""
+
+    def __init__(self, sample_rate, channels, cutoff_freq, order=4):
+        self.channels = channels
+        self.latency = 0
+        self.filter = SosFilter(butter_sos(order, cutoff_freq, 'highpass', sample_rate), 1)
+
+    def process(self, block):
+        if self.channels != 2:
+            # Mono material has no side image
+            return block
+
+        mid = 0.5 * (block[:, 0] + block[:, 1])
+        side = 0.5 * (block[:, 0] - block[:, 1])
+        side = self.filter.process(side[:, None])[:, 0]
+
+        out = np.empty_like(block)
+        out[:, 0] = mid + side
+        out[:, 1] = mid - side
+        return out
+
+    def flush(self):
+        return np.zeros((0, self.channels), dtype=np.float32)
+
+
+class LookaheadLimiter:
+    """Brick-wall peak limiter with look-ahead and exponential release.
+
+    The gain needed to keep each sample under the ceiling is held for the
+    look-ahead window, then smoothed over the same window so that it ramps
+    down before a peak arrives instead of stepping. Release is a one-pole
+    filter that can only pull the gain further down, never above the target.
+    """
+
+    def __init__(self, sample_rate, channels, release_time=100, ceiling_db=-1.0, lookahead_ms=5.0, gain_db=0.0):
+        self.channels = channels
+        self.ceiling = np.float32(10 ** (ceiling_db / 20))
+        self.gain = np.float32(10 ** (gain_db / 20))
+        self.latency = max(1, int(round(lookahead_ms * sample_rate / 1000)))
+
+        coeff = np.exp(-1.0 / max(release_time / 1000 * sample_rate, 1.0))
+        self._release_b = np.array([1 - coeff], dtype=np.float32)
+        self._release_a = np.array([1, -coeff], dtype=np.float32)
+        self._release_zi = np.array([coeff], dtype=np.float32)  # steady state at unity gain
+
+        self._delay = np.zeros((self.latency, channels), dtype=np.float32)
+        self._target_history = np.ones(self.latency, dtype=np.float32)
+        self._hold_history = np.ones(self.latency, dtype=np.float32)
+
+    def process(self, block):
+        if len(block) == 0:
+            return block
+
+        window = self.latency + 1
+        block = block * self.gain
+
+        peak = np.max(np.abs(block), axis=1)
+        target = np.minimum(np.float32(1.0), self.ceiling / np.maximum(peak, np.float32(1e-9)))
+
+        targets = np.concatenate([self._target_history, target])
+        hold = _sliding_reduce(targets, window, np.minimum)
+        holds = np.concatenate([self._hold_history, hold])
+        ramp = _sliding_reduce(holds, window, np.add) / np.float32(window)
+
+        release, self._release_zi = signal.lfilter(self._release_b, self._release_a, ramp, zi=self._release_zi)
+        gain = np.minimum(ramp, release)
+
+        delayed = np.concatenate([self._delay, block])
+        out = delayed[:len(block)] * gain[:, None]
+
+        self._target_history = targets[-self.latency:]
+        self._hold_history = holds[-self.latency:]
+        self._delay = delayed[-self.latency:]
+        return out
+
+    def flush(self):
+        return self.process(np.zeros((self.latency, self.channels), dtype=np.float32))
+
+
+class MultibandExpander:
+    """Downward expander applied independently to each band of an LR4 crossover."""
+
+    def __init__(self, sample_rate, channels, crossovers=(200.0, 2000.0), threshold_db=-40.0,
+                 ratio=1.5, range_db=24.0, rms_time=20):
+        self.channels = channels
+        self.latency = 0
+        self.threshold_db = threshold_db
+        self.ratio = ratio
+        self.range_db = range_db
+
+        crossovers = sorted(crossovers)
+        self._splits = []
+        for index, freq in enumerate(crossovers):
+            lowpass = SosFilter(linkwitz_riley_sos(freq, 'lowpass', sample_rate), channels)
+            highpass = SosFilter(linkwitz_riley_sos(freq, 'highpass', sample_rate), channels)
+            # Keep the low band in phase with the crossovers it does not pass through
+            phase = [SosFilter(allpass_sos(later, sample_rate), channels) for later in crossovers[index + 1:]]
+            self._splits.append((lowpass, highpass, phase))
+
+        coeff = np.exp(-1.0 / max(rms_time / 1000 * sample_rate, 1.0))
+        self._env_b = np.array([1 - coeff], dtype=np.float32)
+        self._env_a = np.array([1, -coeff], dtype=np.float32)
+        self._env_zi = [np.zeros(1, dtype=np.float32) for _ in range(len(crossovers) + 1)]
+
+    def split(self, block):
+        bands = []
+        rest = block
+        for lowpass, highpass, phase in self._splits:
+            low = lowpass.process(rest)
+            rest = highpass.process(rest)
+            for allpass in phase:
+                low = allpass.process(low)
+            bands.append(low)
+        bands.append(rest)
+        return bands
+
+    def process(self, block):
+        out = np.zeros_like(block)
+        for index, band in enumerate(self.split(block)):
+            power = np.mean(band * band, axis=1)
+            envelope, self._env_zi[index] = signal.lfilter(self._env_b, self._env_a, power, zi=self._env_zi[index])
+            level_db = 10 * np.log10(envelope + np.float32(1e-12))
+            gain_db = np.clip((self.ratio - 1) * (level_db - self.threshold_db), -self.range_db, 0)
+            out += band * (10 ** (gain_db / 20)).astype(np.float32)[:, None]
+        return out
+
+    def flush(self):
+        return np.zeros((0, self.channels), dtype=np.float32)
+
+
+class MasteringChain:
+    """Runs processors in series, compensating their combined latency."""
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.latency = sum(stage.latency for stage in self.stages)
+        self._channels = 0
+
+    def process(self, block):
+        self._channels = block.shape[1]
+        for stage in self.stages:
+            block = stage.process(block)
+        return block
+
+    def flush(self):
+        tail = np.zeros((0, self._channels), dtype=np.float32)
+        for stage in self.stages:
+            if len(tail):
+                tail = np.concatenate([stage.process(tail), stage.flush()])
+            else:
+                tail = stage.flush()
+        return tail
@@ -0,0 +1,176 @@
+# eq_match.py
+import os
+import numpy as np
+from scipy import signal
+import loudness
+import storage
+import streaming
+from render_cache import file_digest
+
+# Reference-matching EQ. The long-term spectra of the input and of a reference
+# track are Welch averages of Hann-windowed frames; the ratio between them is
+# smoothed over fractional octaves and turned into a minimum-phase FIR, so the
+# correction adds no latency and no pre-ringing.
+
+NPERSEG = 4096  # frame length of the spectral analysis
+SMOOTHING_OCTAVES = 1 / 3
+MATCH_RANGE = (30.0, 16000.0)  # Hz; the correction is held flat outside this band
+MAX_GAIN_DB = 12.0
+FILTER_TAPS = 2048
+
+
+class SpectrumAnalyzer:
+    """Welch-averaged power spectrum of the mid signal, fed block by block.
+
+    With channel weights it also sums the weighted power spectra of the
+    channels (see channel_result), which is what loudness measures; the mid
+    signal under-counts whatever differs between the channels.
+    """
+
+    def __init__(self, nperseg=NPERSEG, weights=None):
+        self.nperseg = nperseg
+        self.hop = nperseg // 2
+        self.window = np.hanning(nperseg).astype(np.float32)
+        self.weights = weights
+        self.power = np.zeros(nperseg // 2 + 1)
+        self.channel_power = np.zeros(nperseg // 2 + 1)
+        self.frames = 0
+        self._carry = None
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if self.weights is None:
+            block = block.mean(axis=1) if block.ndim > 1 else block
+        elif block.ndim == 1:
+            block = block[:, None]
+        x = block if self._carry is None else np.concatenate([self._carry, block])
+        if len(x) < self.nperseg:
+            self._carry = x
+            return
+
+        # Every complete frame of the block in one strided view and one batched FFT
+        frames = np.lib.stride_tricks.sliding_window_view(x, self.nperseg, axis=0)[::self.hop]
+        spectrum = np.fft.rfft(frames * self.window, axis=-1)
+        if self.weights is not None:
+            # The FFT is linear, so the mid spectrum is the mean of the channel spectra
+            channel_power = spectrum.real ** 2 + spectrum.imag ** 2
+            self.channel_power += np.einsum('fcb,c->b', channel_power, self.weights)
+            spectrum = spectrum.mean(axis=1)
+        self.power += np.sum(spectrum.real ** 2 + spectrum.imag ** 2, axis=0)
+        self.frames += len(frames)
+        self._carry = x[len(frames) * self.hop:]
+
+    def result(self):
+        return self.power / max(self.frames, 1)
+
+    def channel_result(self):
+        return self.channel_power / max(self.frames, 1)
+
+
+def average_spectrum(samples, nperseg=NPERSEG, block_size=streaming.DEFAULT_BLOCK_SIZE):
+    analyzer = SpectrumAnalyzer(nperseg)
+    for start in range(0, len(samples), block_size):
+        analyzer.process(samples[start:start + block_size])
+    return analyzer.result()
+
+
+def cache_path(cache_dir, digest, sample_rate, nperseg=NPERSEG, view='mid'):
+    # view is 'mid' (SpectrumAnalyzer.result) or 'channels' (channel_result)
+    suffix = '' if view == 'mid' else f"_{view}"
+    return os.path.join(cache_dir, f"{digest}_{sample_rate}_{nperseg}{suffix}.npy")
+
+
+def read_cached(cache_dir, digest, sample_rate, nperseg=NPERSEG, view='mid'):
+    try:
+        return np.load(cache_path(cache_dir, digest, sample_rate, nperseg, view))
+    except (OSError, ValueError):
+        return None
+
+
+def store_cached(cache_dir, digest, sample_rate, power, nperseg=NPERSEG, view='mid'):
+    os.makedirs(cache_dir, exist_ok=True)
+    with storage.atomic_write(cache_path(cache_dir, digest, sample_rate, nperseg, view)) as temp_path, \
+            open(temp_path, 'wb') as f:
+        np.save(f, power)
+
+
+def analyze_file(filepath, sample_rate, cache_dir=None, nperseg=NPERSEG, block_size=streaming.DEFAULT_BLOCK_SIZE):
+    # Average spectrum of a file decoded at sample_rate. With cache_dir the
+    # spectrum is stored by file digest, so a reference shared by many tracks
+    # is only analysed once per sample rate.
+    digest = file_digest(filepath) if cache_dir else None
+    if digest is not None:
+        power = read_cached(cache_dir, digest, sample_rate, nperseg)
+        if power is not None:
+            return power
+
+    analyzer = SpectrumAnalyzer(nperseg)
+    for block in streaming.decode_blocks(filepath, block_size, sample_rate=sample_rate):
+        analyzer.process(block)
+    power = analyzer.result()
+
+    if digest is not None:
+        store_cached(cache_dir, digest, sample_rate, power, nperseg)
+    return power
+
+
+def smooth_spectrum(power, octaves=SMOOTHING_OCTAVES):
+    # Mean power over a band of the given width (in octaves) around every bin
+    bins = np.arange(len(power))
+    half_width = 2 ** (octaves / 2)
+    low = np.clip(np.floor(bins / half_width), 0, len(power) - 1).astype(int)
+    high = np.clip(np.ceil(bins * half_width), 0, len(power) - 1).astype(int) + 1
+    cumulative = np.concatenate([[0.0], np.cumsum(power)])
+    return (cumulative[high] - cumulative[low]) / (high - low)
+
+
+def minimum_phase_fir(magnitude, numtaps=FILTER_TAPS):
+    # Homomorphic design: fold the real cepstrum of the log magnitude onto
+    # positive quefrencies to get the minimum-phase response with that magnitude
+    nfft = 2 * (len(magnitude) - 1)
+    cepstrum = np.fft.irfft(np.log(np.maximum(magnitude, 1e-6)), n=nfft)
+    fold = np.zeros(nfft)
+    fold[0] = 1.0
+    fold[1:nfft // 2] = 2.0
+    fold[nfft // 2] = 1.0
+    impulse = np.fft.irfft(np.exp(np.fft.rfft(cepstrum * fold)), n=nfft)[:numtaps]
+
+    # Fade out the truncated tail
+    fade = min(numtaps // 4, len(impulse))
+    impulse[-fade:] *= np.hanning(2 * fade)[fade:]
+    return impulse.astype(np.float32)
+
+
+def match_filter(input_power, reference_power, sample_rate, numtaps=FILTER_TAPS, max_gain_db=MAX_GAIN_DB, strength=1.0):
+    # FIR taps that move the input's tonal balance towards the reference.
+    # Only the spectral shape is matched: the correction is scaled so the
+    # input keeps its overall power, and loudness stays a separate stage.
+    input_smooth = smooth_spectrum(input_power)
+    reference_smooth = smooth_spectrum(reference_power)
+    freqs = np.linspace(0, sample_rate / 2, len(input_power))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain_db = 10 * np.log10(np.maximum(reference_smooth, 1e-20) / np.maximum(input_smooth, 1e-20))
+    low, high = np.searchsorted(freqs, MATCH_RANGE)
+    high = min(high, len(freqs) - 1)
+    gain_db[:low] = gain_db[low]
+    gain_db[high:] = gain_db[high]
+
+    # Matching the level is loudness normalization's job, so remove the power-weighted mean gain first
+    weights = input_smooth / max(np.sum(input_smooth), 1e-20)
+    gain_db -= 10 * np.log10(max(np.sum(weights * 10 ** (gain_db / 10)), 1e-20))
+    gain_db = np.clip(gain_db * strength, -max_gain_db, max_gain_db)
+    return minimum_phase_fir(10 ** (gain_db / 20), numtaps)
+
+
+def loudness_change(taps, channel_power, sample_rate):
+    # dB by which the FIR changes the input's K-weighted power, estimated from
+    # its channel spectrum (SpectrumAnalyzer.channel_result). The loudness gain
+    # is measured before the filter runs, so it is corrected by this much to
+    # land on the target.
+    nfft = 2 * (len(channel_power) - 1)
+    response = np.abs(np.fft.rfft(taps, n=nfft)) ** 2
+    _, weighting = signal.sosfreqz(loudness.k_weighting_sos(sample_rate), worN=np.fft.rfftfreq(nfft, 1 / sample_rate),
+                                   fs=sample_rate)
+    weighted = channel_power * np.abs(weighting) ** 2
+    return 10 * np.log10(max(np.sum(weighted * response), 1e-20) / max(np.sum(weighted), 1e-20))
@@ -0,0 +1,262 @@
+# instrumentation.py
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import storage
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Per-stage timing for the mastering chains. Every stage records wall time,
+# CPU time, the process's peak RSS and how many seconds of audio it handled.
+# Records go to the process-wide REGISTRY, which renders Prometheus metrics,
+# and to the trace active in the current context, if any. A trace is a plain
+# list of records that can be returned from a pool worker and saved as JSON.
+# Only the standard library is needed, so importing this stays cheap.
+
+# Histogram buckets for stage and job wall time, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_current_trace = contextvars.ContextVar('mastering_trace', default=None)
+
+
+def peak_rss():
+    # High-water mark of the process's resident memory in bytes, or None if unknown
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # KiB everywhere but macOS
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+
+def make_record(stage, wall, cpu, audio_seconds=None):
+    return {
+        'stage': stage,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'peak_rss_bytes': peak_rss(),
+        'audio_seconds': audio_seconds,
+        'audio_seconds_per_second': audio_seconds / wall if audio_seconds and wall > 0 else None,
+    }
+
+
+def record(stage, wall, cpu, audio_seconds=None):
+    # Add a finished stage to the active trace and the registry
+    entry = make_record(stage, wall, cpu, audio_seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(entry)
+    REGISTRY.observe(entry)
+    return entry
+
+
+@contextmanager
+def stage(name, audio_seconds=None):
+    # Time the body as one stage. The yielded dict may set 'audio_seconds'
+    # when the amount of audio is only known afterwards (e.g. after decoding).
+    timing = {'audio_seconds': audio_seconds}
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    yield timing
+    record(name, time.perf_counter() - wall, time.process_time() - cpu, timing['audio_seconds'])
+
+
+def timed_stage(name):
+    # Decorator for AudioProcessor.apply_* style methods, called as (self, samples, sample_rate, ...)
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, samples, sample_rate, *args, **kwargs):
+            with stage(name, len(samples) / sample_rate):
+                return method(self, samples, sample_rate, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Accumulator:
+    """Time spent in one stage over many short calls, e.g. once per block."""
+
+    def __init__(self, name, sample_rate=None):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.frames = 0
+
+    @contextmanager
+    def measure(self, frames=0):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        yield
+        self.wall += time.perf_counter() - wall
+        self.cpu += time.process_time() - cpu
+        self.frames += frames
+
+    def finish(self):
+        audio_seconds = self.frames / self.sample_rate if self.sample_rate else None
+        return record(self.name, self.wall, self.cpu, audio_seconds)
+
+
+class TimedProcessor:
+    """Wraps a dsp processor (latency/process/flush) and times it across blocks."""
+
+    def __init__(self, processor, name, sample_rate):
+        self.processor = processor
+        self.latency = processor.latency
+        self.timing = Accumulator(name, sample_rate)
+
+    def process(self, block):
+        with self.timing.measure(len(block)):
+            return self.processor.process(block)
+
+    def flush(self):
+        with self.timing.measure():
+            return self.processor.flush()
+
+
+class Trace:
+    """Stage records for one job; activate() makes stages in this context record into it."""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.started_at = time.time()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        with self._lock:
+            self.stages.append(entry)
+
+    @contextmanager
+    def activate(self):
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def to_dict(self):
+        with self._lock:
+            stages = list(self.stages)
+        peaks = [entry['peak_rss_bytes'] for entry in stages if entry['peak_rss_bytes'] is not None]
+        return {
+            'name': self.name,
+            'started_at': self.started_at,
+            'wall_seconds': time.time() - self.started_at,
+            'peak_rss_bytes': max(peaks) if peaks else None,
+            'stages': stages,
+        }
+
+    def save(self, path):
+        save_trace(self.to_dict(), path)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def save_trace(trace, path):
+    # Write a trace dict as JSON, atomically
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with storage.atomic_write(path) as temp_path, open(temp_path, 'w') as f:
+        json.dump(trace, f, indent=2)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels.items()) + '}'
+
+
+class MetricsRegistry:
+    """Process-wide stage metrics in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_seconds = {}
+        self.stage_cpu_seconds = {}
+        self.stage_audio_seconds = {}
+        self.job_seconds = Histogram()
+        self.peak_rss_bytes = 0
+
+    def observe(self, entry):
+        with self._lock:
+            name = entry['stage']
+            self.stage_seconds.setdefault(name, Histogram()).observe(entry['wall_seconds'])
+            self.stage_cpu_seconds[name] = self.stage_cpu_seconds.get(name, 0.0) + entry['cpu_seconds']
+            if entry['audio_seconds']:
+                self.stage_audio_seconds[name] = self.stage_audio_seconds.get(name, 0.0) + entry['audio_seconds']
+            if entry['peak_rss_bytes']:
+                self.peak_rss_bytes = max(self.peak_rss_bytes, entry['peak_rss_bytes'])
+
+    def record_trace(self, trace):
+        # Fold in a trace dict produced elsewhere, e.g. returned by a pool worker
+        for entry in trace['stages']:
+            self.observe(entry)
+        with self._lock:
+            self.job_seconds.observe(trace['wall_seconds'])
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += ['# HELP mastering_stage_seconds Wall time of each mastering stage.',
+                      '# TYPE mastering_stage_seconds histogram']
+            for name, histogram in sorted(self.stage_seconds.items()):
+                lines += _histogram_lines('mastering_stage_seconds', histogram, stage=name)
+
+            lines += ['# HELP mastering_stage_cpu_seconds_total CPU time spent in each mastering stage.',
+                      '# TYPE mastering_stage_cpu_seconds_total counter']
+            lines += [f'mastering_stage_cpu_seconds_total{_labels(stage=name)} {value}'
+                      for name, value in sorted(self.stage_cpu_seconds.items())]
+
+            lines += ['# HELP mastering_stage_audio_seconds_total Seconds of audio processed by each mastering stage.',
+                      '# TYPE mastering_stage_audio_seconds_total counter']
+            lines += [f'mastering_stage_audio_seconds_total{_labels(stage=name)} {value}'
+                      for name, value in sorted(self.stage_audio_seconds.items())]
+
+            lines += ['# HELP mastering_job_seconds Wall time of whole mastering jobs.',
+                      '# TYPE mastering_job_seconds histogram']
+            lines += _histogram_lines('mastering_job_seconds', self.job_seconds)
+
+            lines += ['# HELP mastering_peak_rss_bytes Highest peak RSS reported by a mastering stage.',
+                      '# TYPE mastering_peak_rss_bytes gauge',
+                      f'mastering_peak_rss_bytes {self.peak_rss_bytes}']
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(metric, histogram, **labels):
+    lines = [f'{metric}_bucket{_labels(**labels, le=bound)} {count}'
+             for bound, count in zip(histogram.buckets, histogram.counts)]
+    lines.append(f'{metric}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+    lines.append(f'{metric}_sum{_labels(**labels) if labels else ""} {histogram.sum}')
+    lines.append(f'{metric}_count{_labels(**labels) if labels else ""} {histogram.count}')
+    return lines
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,313 @@
+# jobs.py
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import instrumentation
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def create_schema(db_path):
+    conn = connect(db_path)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            quality TEXT,
+            audio_type TEXT,
+            options TEXT,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            output_filename TEXT,
+            error TEXT,
+            owner TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    # Databases created before per-job mastering options existed
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(jobs)')]
+    if 'options' not in columns:
+        conn.execute('ALTER TABLE jobs ADD COLUMN options TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS jobs_state_seq ON jobs (state, seq)')
+    conn.commit()
+    conn.close()
+
+
+def update_job(db_path, job_id, **fields):
+    fields['updated_at'] = time.time()
+    columns = ', '.join(f'{name} = ?' for name in fields)
+    conn = connect(db_path)
+    try:
+        conn.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_mastering_job(db_path, job_id, upload_folder, output_folder, processor_options, filename, quality, audio_type,
+                      options=None):
+    # Runs inside a pool worker process, so it only receives picklable arguments
+    from audio_processor import AudioProcessor
+
+    processor = AudioProcessor(upload_folder, output_folder, **processor_options)
+
+    def report(progress, message):
+        update_job(db_path, job_id, progress=progress, message=message)
+
+    # The trace goes back to the web process with the result, since metrics recorded here die with the worker
+    trace = instrumentation.Trace(job_id)
+    with trace.activate():
+        output_filename = processor.master_file(filename, quality, audio_type, progress=report, **(options or {}))
+    return {'output_filename': output_filename, 'trace': trace.to_dict()}
+
+
+def _owner_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _owner_alive(owner):
+    # A running job belongs to the web process that dispatched it; if that
+    # process is gone the job was interrupted and can be queued again.
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Persistent, bounded mastering queue served by a process pool.
+
+    Jobs live in an SQLite table so that queued work survives a restart.
+    A dispatcher thread moves queued jobs into the pool, never holding more
+    than ``max_workers`` in flight.
+    """
+
+    def __init__(self, db_path, upload_folder, output_folder, max_workers=None, max_queued=32, processor_options=None,
+                 trace_folder=None):
+        self.db_path = db_path
+        self.upload_folder = upload_folder
+        self.output_folder = output_folder
+        self.processor_options = dict(processor_options or {})  # Passed to AudioProcessor in each worker
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.trace_folder = trace_folder  # Each finished job's stage trace is saved here as <job_id>.json
+        self.owner = None
+
+        self._executor = None
+        self._dispatcher = None
+        self._slots = threading.Semaphore(self.max_workers)
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stopping = False
+        self._retried = set()  # Jobs already requeued once after the pool broke under them
+
+    def start(self):
+        with self._start_lock:
+            if self._dispatcher is not None:
+                return
+
+            self.owner = _owner_id()
+            create_schema(self.db_path)
+            self._requeue_interrupted()
+
+            self._executor = self._new_executor()
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='mastering-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _new_executor(self):
+        # Spawn keeps the workers free of the web server's threads and sockets
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def shutdown(self, wait=True):
+        self._stopping = True
+        self._wakeup.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def submit(self, filename, quality, audio_type, options=None):
+        # options are extra AudioProcessor.master_file keyword arguments, stored as JSON
+        self.start()
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = connect(self.db_path)
+        try:
+            # BEGIN IMMEDIATE makes the capacity check and the insert atomic across web processes
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            pending = conn.execute('SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)',
+                                   (JOB_QUEUED, JOB_RUNNING)).fetchone()[0]
+            if pending >= self.max_queued:
+                conn.execute('ROLLBACK')
+                raise QueueFullError(f'Mastering queue is full ({pending} jobs pending)')
+
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs').fetchone()[0]
+            conn.execute('''
+                INSERT INTO jobs (id, seq, state, filename, quality, audio_type, options, message, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_id, seq, JOB_QUEUED, filename, quality, audio_type, json.dumps(options or {}), 'Queued', now, now))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+        self._wakeup.set()
+        return job_id
+
+    def active_files(self):
+        # Uploads that queued and running jobs still need, as (area, name) pairs for the storage manager
+        conn = connect(self.db_path)
+        try:
+            rows = conn.execute('SELECT filename, options FROM jobs WHERE state IN (?, ?)',
+                                (JOB_QUEUED, JOB_RUNNING)).fetchall()
+        except sqlite3.OperationalError as e:
+            if 'no such table' in str(e):
+                return set()  # No jobs table before the queue first starts
+            return None  # Unknown (e.g. the database is locked); callers must not assume nothing is in use
+        finally:
+            conn.close()
+
+        files = set()
+        for row in rows:
+            files.add(('uploads', row['filename']))
+            reference = json.loads(row['options'] or '{}').get('reference')
+            if reference:
+                files.add(('uploads', reference))
+        return files
+
+    def trace_path(self, job_id):
+        return os.path.join(self.trace_folder, f'{job_id}.json')
+
+    def get_job(self, job_id):
+        conn = connect(self.db_path)
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job['state'] == JOB_QUEUED:
+                job['queue_position'] = conn.execute('SELECT COUNT(*) FROM jobs WHERE state = ? AND seq < ?',
+                                                     (JOB_QUEUED, job['seq'])).fetchone()[0]
+            return job
+        finally:
+            conn.close()
+
+    def _requeue_interrupted(self):
+        conn = connect(self.db_path)
+        try:
+            running = conn.execute('SELECT id, owner FROM jobs WHERE state = ?', (JOB_RUNNING,)).fetchall()
+            for row in running:
+                if not _owner_alive(row['owner']):
+                    conn.execute('UPDATE jobs SET state = ?, owner = NULL, progress = 0, message = ? WHERE id = ?',
+                                 (JOB_QUEUED, 'Requeued after restart', row['id']))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _claim_next(self):
+        conn = connect(self.db_path)
+        try:
+            while True:
+                row = conn.execute('SELECT * FROM jobs WHERE state = ? ORDER BY seq LIMIT 1', (JOB_QUEUED,)).fetchone()
+                if row is None:
+                    return None
+                # Another web process may claim the same row; only one UPDATE wins
+                claimed = conn.execute('UPDATE jobs SET state = ?, owner = ?, message = ?, updated_at = ? WHERE id = ? AND state = ?',
+                                       (JOB_RUNNING, self.owner, 'Mastering started', time.time(), row['id'], JOB_QUEUED))
+                conn.commit()
+                if claimed.rowcount == 1:
+                    return dict(row)
+        finally:
+            conn.close()
+
+    def _dispatch_loop(self):
+        while not self._stopping:
+            self._slots.acquire()
+            try:
+                job = self._claim_next()
+            except sqlite3.Error:
+                job = None
+
+            if job is None:
+                self._slots.release()
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+
+            try:
+                future = self._submit(job)
+            except Exception as e:
+                self._slots.release()
+                update_job(self.db_path, job['id'], state=JOB_FAILED, message='Mastering failed', error=str(e))
+                continue
+            future.add_done_callback(partial(self._on_done, job['id']))
+
+    def _submit(self, job):
+        args = (run_mastering_job, self.db_path, job['id'], self.upload_folder, self.output_folder,
+                self.processor_options, job['filename'], job['quality'], job['audio_type'],
+                json.loads(job['options'] or '{}'))
+        try:
+            return self._executor.submit(*args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory) and took the pool with it; the
+            # claimed job never ran, so it goes to a new pool and fails only if that breaks too
+            self._executor.shutdown(wait=False)
+            self._executor = self._new_executor()
+            return self._executor.submit(*args)
+
+    def _requeue_crashed(self, job_id, error):
+        # A job whose worker died gets one more run; a second crash marks it failed
+        if job_id in self._retried:
+            self._retried.discard(job_id)
+            update_job(self.db_path, job_id, state=JOB_FAILED, message='Mastering failed', error=error)
+            return
+        self._retried.add(job_id)
+        update_job(self.db_path, job_id, state=JOB_QUEUED, owner=None, progress=0, message='Requeued after a worker crash')
+        self._wakeup.set()
+
+    def _on_done(self, job_id, future):
+        self._slots.release()
+        try:
+            result = future.result()
+            instrumentation.REGISTRY.record_trace(result['trace'])
+            if self.trace_folder:
+                instrumentation.save_trace(result['trace'], self.trace_path(job_id))
+            update_job(self.db_path, job_id, state=JOB_DONE, progress=1.0,
+                       message='Mastering completed', output_filename=result['output_filename'])
+        except BrokenProcessPool:
+            self._requeue_crashed(job_id, 'Mastering worker crashed')
+            return
+        except Exception as e:
+            update_job(self.db_path, job_id, state=JOB_FAILED, message='Mastering failed', error=str(e))
+        self._retried.discard(job_id)
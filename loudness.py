@@ -0,0 +1,260 @@
+# loudness.py
+import json
+import math
+import os
+import numpy as np
+from scipy import signal
+import dsp
+import storage
+import streaming
+from render_cache import file_digest
+
+# ITU-R BS.1770 / EBU R128 loudness measurement shared by the web and desktop
+# mastering paths. One pass over float32 blocks collects K-weighted energy in
+# 100 ms steps plus the true peak; momentary (400 ms), short-term (3 s),
+# integrated loudness and loudness range are all derived from those steps.
+
+STEP_SECONDS = 0.1
+MOMENTARY_STEPS = 4
+SHORT_TERM_STEPS = 30
+ABSOLUTE_GATE = -70.0  # LUFS
+RELATIVE_GATE = -10.0  # LU, integrated loudness
+LRA_RELATIVE_GATE = -20.0  # LU, loudness range
+TAPS_PER_PHASE = 12
+
+
+def k_weighting_sos(sample_rate):
+    # BS.1770 pre-filter (high shelf) and RLB high-pass, designed for any sample rate
+    k = math.tan(math.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    k = math.tan(math.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, highpass])
+
+
+def channel_weights(channels):
+    # Left, right and centre count once; surround channels (5.1 order, no LFE handling) count 1.41
+    return np.array([1.0 if index < 3 else 1.41 for index in range(channels)])
+
+
+def to_lufs(energy):
+    with np.errstate(divide='ignore'):
+        return -0.691 + 10 * np.log10(energy)
+
+
+class TruePeakMeter:
+    """Peak of the signal oversampled 4x (2x from 96 kHz) with a polyphase FIR.
+
+    The last input samples are carried between blocks, so the interpolated
+    peak does not depend on where the block boundaries fall. Chunks whose
+    sample peak cannot interpolate above the running peak are skipped, which
+    leaves most of a track un-oversampled without changing the result.
+    """
+
+    def __init__(self, sample_rate, channels, chunk_size=4096):
+        self.factor = 4 if sample_rate < 96000 else 2 if sample_rate < 192000 else 1
+        self.taps = signal.firwin(TAPS_PER_PHASE * self.factor, 1.0 / self.factor).astype(np.float32) * self.factor
+        self.history = np.zeros((-(-(len(self.taps) - 1) // self.factor), channels), dtype=np.float32)
+        # No interpolated sample can exceed the input peak times the largest phase gain
+        self.bound = float(max(np.sum(np.abs(self.taps[phase::self.factor])) for phase in range(self.factor)))
+        self.chunk_size = chunk_size
+        self.peak = 0.0
+
+    def _upsampled_peak(self, block):
+        x = np.concatenate([self.history, block])
+        lead = len(self.history)
+        peak = self.peak
+        for start in range(0, len(block), self.chunk_size):
+            stop = min(start + self.chunk_size, len(block))
+            window = x[start:lead + stop]
+            if float(np.max(np.abs(window))) * self.bound <= peak:
+                continue
+            if self.factor == 1:
+                peak = max(peak, float(np.max(np.abs(window[lead:]))))
+                continue
+            y = signal.upfirdn(self.taps, window, up=self.factor, axis=0)
+            peak = max(peak, float(np.max(np.abs(y[self.factor * lead:self.factor * (lead + stop - start)]))))
+        return peak
+
+    def process(self, block):
+        self.peak = self._upsampled_peak(block)
+        if len(self.history):
+            self.history = np.concatenate([self.history, block])[-len(self.history):]
+
+    def result(self):
+        # Include the ringing after the last sample without advancing the state
+        return self._upsampled_peak(np.zeros_like(self.history))
+
+
+class LoudnessStats:
+    def __init__(self, integrated, loudness_range, true_peak, sample_peak, momentary, short_term):
+        self.integrated = integrated  # LUFS
+        self.loudness_range = loudness_range  # LU
+        self.true_peak = true_peak  # dBTP
+        self.sample_peak = sample_peak  # dBFS
+        self.momentary = momentary  # LUFS every 100 ms
+        self.short_term = short_term  # LUFS every 100 ms
+
+    @property
+    def momentary_max(self):
+        return max(self.momentary, default=-math.inf)
+
+    @property
+    def short_term_max(self):
+        return max(self.short_term, default=-math.inf)
+
+    def to_dict(self):
+        return {
+            'integrated': self.integrated,
+            'loudness_range': self.loudness_range,
+            'true_peak': self.true_peak,
+            'sample_peak': self.sample_peak,
+            'momentary': self.momentary,
+            'short_term': self.short_term,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class LoudnessMeter:
+    """Streaming loudness meter; feed float32 blocks shaped (frames, channels)."""
+
+    def __init__(self, sample_rate, channels):
+        self.k_filter = dsp.SosFilter(k_weighting_sos(sample_rate), channels)
+        self.weights = channel_weights(channels)
+        self.step = max(int(round(sample_rate * STEP_SECONDS)), 1)
+        self.true_peak = TruePeakMeter(sample_rate, channels)
+        self.sample_peak = 0.0
+        self._steps = []  # weighted energy summed over each complete 100 ms step
+        self._carry = np.zeros(0)
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if not len(block):
+            return
+        self.sample_peak = max(self.sample_peak, float(np.max(np.abs(block))))
+        self.true_peak.process(block)
+
+        weighted = self.k_filter.process(block).astype(np.float64)
+        energy = np.concatenate([self._carry, (weighted * weighted) @ self.weights])
+        complete = len(energy) - len(energy) % self.step
+        if complete:
+            self._steps.append(energy[:complete].reshape(-1, self.step).sum(axis=1))
+        self._carry = energy[complete:]
+
+    def _windowed(self, steps, width):
+        # Mean energy of every window of width steps, hopping one step
+        if len(steps) < width:
+            return np.zeros(0)
+        cumulative = np.concatenate([[0.0], np.cumsum(steps)])
+        return (cumulative[width:] - cumulative[:-width]) / (width * self.step)
+
+    def result(self):
+        steps = np.concatenate(self._steps) if self._steps else np.zeros(0)
+        momentary = self._windowed(steps, MOMENTARY_STEPS)
+        short_term = self._windowed(steps, SHORT_TERM_STEPS)
+        return LoudnessStats(
+            integrated=gated_loudness(momentary, RELATIVE_GATE),
+            loudness_range=loudness_range(short_term),
+            true_peak=float(20 * np.log10(max(self.true_peak.result(), self.sample_peak, 1e-10))),
+            sample_peak=float(20 * np.log10(max(self.sample_peak, 1e-10))),
+            momentary=[round(float(value), 2) for value in to_lufs(momentary)],
+            short_term=[round(float(value), 2) for value in to_lufs(short_term)],
+        )
+
+
+def _gate(energies, relative_gate):
+    energies = energies[to_lufs(energies) > ABSOLUTE_GATE]
+    if not len(energies):
+        return energies
+    threshold = to_lufs(np.mean(energies)) + relative_gate
+    return energies[to_lufs(energies) > threshold]
+
+
+def gated_loudness(energies, relative_gate):
+    gated = _gate(energies, relative_gate)
+    return float(to_lufs(np.mean(gated))) if len(gated) else -math.inf
+
+
+def loudness_range(short_term_energies):
+    gated = _gate(short_term_energies, LRA_RELATIVE_GATE)
+    if not len(gated):
+        return 0.0
+    low, high = np.percentile(to_lufs(gated), [10, 95])
+    return float(high - low)
+
+
+def analyze_array(samples, sample_rate, block_size=streaming.DEFAULT_BLOCK_SIZE):
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    meter = LoudnessMeter(sample_rate, samples.shape[1])
+    for start in range(0, len(samples), block_size):
+        meter.process(samples[start:start + block_size])
+    return meter.result()
+
+
+def cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, f"{digest}.json")
+
+
+def read_cached(cache_dir, digest):
+    try:
+        with open(cache_path(cache_dir, digest)) as f:
+            return LoudnessStats.from_dict(json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def store_cached(cache_dir, digest, stats):
+    # Write the sidecar atomically, so concurrent readers never see a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, digest)
+    with storage.atomic_write(path) as temp_path, open(temp_path, 'w') as f:
+        json.dump(stats.to_dict(), f)
+
+
+def load_cached(filepath, cache_dir):
+    # Return the stats measured earlier for identical audio bytes, or None
+    return read_cached(cache_dir, file_digest(filepath))
+
+
+def analyze_file(filepath, cache_dir=None, block_size=streaming.DEFAULT_BLOCK_SIZE):
+    # Measure a file in one decode pass; with cache_dir the result is kept as
+    # a JSON sidecar keyed by the file digest and reused for identical audio
+    digest = file_digest(filepath) if cache_dir else None
+    if digest is not None:
+        stats = read_cached(cache_dir, digest)
+        if stats is not None:
+            return stats
+
+    info = streaming.probe(filepath)
+    meter = LoudnessMeter(info.sample_rate, info.channels)
+    for block in streaming.decode_blocks(filepath, block_size, info.sample_rate, info.channels):
+        meter.process(block)
+    stats = meter.result()
+
+    if digest is not None:
+        store_cached(cache_dir, digest, stats)
+    return stats
+
+
+def normalization_gain(stats, target_lufs, true_peak_ceiling=None):
+    # Gain in dB that brings the integrated loudness to the target, optionally
+    # held back so the true peak stays under the ceiling
+    if not math.isfinite(stats.integrated):
+        return 0.0
+    gain_db = target_lufs - stats.integrated
+    if true_peak_ceiling is not None:
+        gain_db = min(gain_db, true_peak_ceiling - stats.true_peak)
+    return gain_db
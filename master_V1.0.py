@@ -5,10 +5,10 @@ import numpy as np
 from pydub import AudioSegment
 from pydub.playback import play
 from pydub.effects import normalize
-import pyloudnorm as pyln
-from spleeter.separator import Separator
 import threading
-import librosa
+import advanced_mastering
+import instrumentation
+import separation
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning) 
 
@@ -25,11 +25,13 @@ class MasteringToolApp:
         menubar.add_cascade(label="File", menu=file_menu)
         file_menu.add_command(label="Load Unmastered Audio", command=self.load_audio)
         file_menu.add_command(label="Save Mastered Audio", command=self.save_audio)
+        file_menu.add_command(label="Save Processing Trace", command=self.save_trace)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=root.quit)
 
         self.input_file = None
         self.output_file = None
+        self.trace = None  # Stage timings of the last mastering run
 
         self.load_button = tk.Button(root, text="Load Unmastered Audio", command=self.load_audio)
         self.load_button.pack(pady=10)
@@ -46,6 +48,9 @@ class MasteringToolApp:
         self.status_label = tk.Label(root, text="", bd=1, relief=tk.SUNKEN, anchor=tk.W)
         self.status_label.pack(side=tk.BOTTOM, fill=tk.X)
 
+        # Load the separation model in the background while the user picks a file
+        threading.Thread(target=separation.warm_up, daemon=True).start()
+
     def load_audio(self):
         self.input_file = filedialog.askopenfilename(filetypes=[("Audio Files", "*.wav *.mp3")])
         if not self.input_file:
@@ -63,17 +68,27 @@ class MasteringToolApp:
 
     def process_audio(self):
         try:
-            audio, sr = self.load_audio_file(self.input_file)
-            if audio is None:
-                return
-
-            processed_audio = self.apply_advanced_processing(audio, sr)
-            if processed_audio is None:
-                return
-
-            self.output_file = "mastered_audio.wav"
-            self.save_audio_file(processed_audio, sr, self.output_file)
-            self.update_status("Advanced mastering complete!")
+            trace = instrumentation.Trace(self.input_file)
+            with trace.activate():
+                with instrumentation.stage('load') as timing:
+                    audio, sr = self.load_audio_file(self.input_file)
+                    if audio is not None:
+                        timing['audio_seconds'] = len(audio) / sr
+                if audio is None:
+                    return
+
+                processed_audio = self.apply_advanced_processing(audio, sr)
+                if processed_audio is None:
+                    return
+
+                self.output_file = "mastered_audio.wav"
+                with instrumentation.stage('save', len(audio) / sr):
+                    self.save_audio_file(processed_audio, sr, self.output_file)
+
+            self.trace = trace.to_dict()
+            self.update_status(f"Advanced mastering complete! {len(audio) / sr:.1f} s of audio in "
+                               f"{self.trace['wall_seconds']:.1f} s "
+                               f"({len(audio) / sr / max(self.trace['wall_seconds'], 1e-9):.2f}x realtime)")
 
         except Exception as e:
             self.update_status(f"An error occurred: {str(e)}")
@@ -85,6 +100,18 @@ class MasteringToolApp:
                 audio, sr = self.load_audio_file(self.output_file)
                 self.save_audio_file(audio, sr, save_path)
 
+    def save_trace(self):
+        if self.trace is None:
+            messagebox.showerror("Error", "Master an audio file first.")
+            return
+        save_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON Files", "*.json")])
+        if save_path:
+            try:
+                instrumentation.save_trace(self.trace, save_path)
+                self.update_status(f"Trace saved as: {save_path}")
+            except Exception as e:
+                self.update_status(f"Error saving trace: {str(e)}")
+
     def play_mastered_audio(self):
         if self.output_file:
             normalized_audio = self.normalize_audio(AudioSegment.from_file(self.output_file))
@@ -107,26 +134,7 @@ class MasteringToolApp:
 
     def apply_advanced_processing(self, audio, sr):
         try:
-            # Apply high-quality high-pass filter using librosa
-            processed_audio = librosa.effects.preemphasis(audio)
-
-            # Apply loudness normalization using LoudNorm
-            meter = pyln.Meter(sr)
-            loudness_target = -16.0  # LUFS
-            integrated_loudness = meter.integrated_loudness(processed_audio)
-            loudness_diff = loudness_target - integrated_loudness
-            processed_audio = pyln.normalize.loudness(processed_audio, loudness_diff, target_loudness=loudness_target)
-
-            # Apply source separation using Spleeter (5-stem model)
-            separator = Separator('spleeter:5stems')
-            separated_audio = separator.separate(processed_audio)
-
-            # Process each stem separately (e.g., compression, EQ, etc.)
-
-            # Combine the stems back together
-            processed_audio = sum(separated_audio.values())
-
-            return processed_audio
+            return advanced_mastering.apply_advanced_processing(audio, sr)
 
         except Exception as e:
             self.update_status(f"Error applying advanced processing: {str(e)}")
@@ -0,0 +1,189 @@
+# peaks.py
+import os
+import numpy as np
+import storage
+
+# Waveform and spectrogram summaries for the player. While a file is
+# mastered, the decoded input and the chain's output are both fed through a
+# SummaryBuilder, which keeps per-bucket min/max peaks and band energies. The
+# result is saved as an .npz of small arrays at several resolutions, each
+# level four times coarser than the one before, so the player can fetch just
+# enough points for its width instead of decoding the whole file.
+
+BASE_BUCKET = 256  # samples per peak bucket at the finest level
+LEVEL_FACTOR = 4
+MIN_LEVEL_SIZE = 256  # stop adding coarser levels once a level has fewer buckets than this
+
+SPECTROGRAM_NFFT = 2048
+SPECTROGRAM_HOP_SECONDS = 0.1
+SPECTROGRAM_BANDS = 64
+SPECTROGRAM_RANGE = (20.0, 20000.0)  # Hz, split into log-spaced bands
+SPECTROGRAM_FLOOR_DB = -100.0  # maps to 0; 0 dBFS maps to 255
+
+
+def _level_sizes(count, base):
+    # Bucket sizes of every level for a signal of count base buckets
+    sizes = [base]
+    while count > MIN_LEVEL_SIZE:
+        count = -(-count // LEVEL_FACTOR)
+        sizes.append(sizes[-1] * LEVEL_FACTOR)
+    return sizes
+
+
+class PeakBuilder:
+    """Min/max of the mix-down per BASE_BUCKET samples, fed block by block."""
+
+    def __init__(self, bucket=BASE_BUCKET):
+        self.bucket = bucket
+        self._low = []
+        self._high = []
+        self._carry = np.zeros((0, 2), dtype=np.float32)
+
+    def process(self, block):
+        # Extremes across channels first, so every bucket covers all of them
+        extremes = np.stack([block.min(axis=1), block.max(axis=1)], axis=1) if block.ndim > 1 \
+            else np.stack([block, block], axis=1)
+        x = np.concatenate([self._carry, extremes])
+        full = len(x) // self.bucket * self.bucket
+        if full:
+            buckets = x[:full].reshape(-1, self.bucket, 2)
+            self._low.append(buckets[:, :, 0].min(axis=1))
+            self._high.append(buckets[:, :, 1].max(axis=1))
+        self._carry = x[full:]
+
+    def result(self):
+        # {bucket size: int8 array shaped (buckets, 2) of min/max pairs}
+        low = self._low + ([self._carry[:, 0].min(keepdims=True)] if len(self._carry) else [])
+        high = self._high + ([self._carry[:, 1].max(keepdims=True)] if len(self._carry) else [])
+        low = np.concatenate(low) if low else np.zeros(0, dtype=np.float32)
+        high = np.concatenate(high) if high else np.zeros(0, dtype=np.float32)
+
+        levels = {}
+        for size in _level_sizes(len(low), self.bucket):
+            if size != self.bucket:
+                starts = np.arange(0, len(low), LEVEL_FACTOR)
+                low = np.minimum.reduceat(low, starts) if len(low) else low
+                high = np.maximum.reduceat(high, starts) if len(high) else high
+            # Round outwards so a peak is never drawn smaller than it is
+            levels[size] = np.stack([np.floor(np.clip(low, -1, 1) * 127),
+                                     np.ceil(np.clip(high, -1, 1) * 127)], axis=1).astype(np.int8)
+        return levels
+
+
+class SpectrogramBuilder:
+    """Band energies of the mid signal every hop, fed block by block."""
+
+    def __init__(self, sample_rate, hop_seconds=SPECTROGRAM_HOP_SECONDS, nfft=SPECTROGRAM_NFFT, bands=SPECTROGRAM_BANDS):
+        self.nfft = nfft
+        self.hop = max(1, int(round(hop_seconds * sample_rate)))
+        self.window = np.hanning(nfft).astype(np.float32)
+        self.scale = np.float32((2 / np.sum(self.window)) ** 2)  # a full-scale sine reads 0 dB
+        self.bands = self._band_matrix(sample_rate, nfft, bands)
+        self._frames = []
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._skip = 0  # samples to drop before the next frame when the hop is longer than a frame
+
+    @staticmethod
+    def _band_matrix(sample_rate, nfft, bands):
+        # (bins, bands) averaging matrix; a band narrower than one bin takes its nearest bin
+        freqs = np.fft.rfftfreq(nfft, 1 / sample_rate)
+        edges = np.geomspace(SPECTROGRAM_RANGE[0], min(SPECTROGRAM_RANGE[1], sample_rate / 2), bands + 1)
+        matrix = np.zeros((len(freqs), bands), dtype=np.float32)
+        for band in range(bands):
+            inside = (freqs >= edges[band]) & (freqs < edges[band + 1])
+            if not inside.any():
+                inside = np.arange(len(freqs)) == np.argmin(np.abs(freqs - np.sqrt(edges[band] * edges[band + 1])))
+            matrix[inside, band] = 1 / np.count_nonzero(inside)
+        return matrix
+
+    def process(self, block):
+        mid = block.mean(axis=1) if block.ndim > 1 else block
+        if self._skip:
+            dropped = min(self._skip, len(mid))
+            mid = mid[dropped:]
+            self._skip -= dropped
+        x = np.concatenate([self._carry, mid])
+        if len(x) < self.nfft:
+            self._carry = x
+            return
+
+        frames = np.lib.stride_tricks.sliding_window_view(x, self.nfft)[::self.hop]
+        spectrum = np.fft.rfft(frames * self.window, axis=1)
+        self._frames.append((spectrum.real ** 2 + spectrum.imag ** 2) * self.scale @ self.bands)
+        next_start = len(frames) * self.hop
+        self._carry = x[next_start:]
+        self._skip = max(0, next_start - len(x))
+
+    def result(self):
+        # {hop in samples: uint8 array shaped (frames, bands)}, power averaged into the coarser levels
+        power = np.concatenate(self._frames) if self._frames else np.zeros((0, self.bands.shape[1]), dtype=np.float32)
+        levels = {}
+        for size in _level_sizes(len(power), self.hop):
+            if size != self.hop and len(power):
+                starts = np.arange(0, len(power), LEVEL_FACTOR)
+                counts = np.diff(np.append(starts, len(power)))[:, None]
+                power = np.add.reduceat(power, starts, axis=0) / counts
+            level_db = 10 * np.log10(np.maximum(power, 1e-12))
+            levels[size] = np.clip((level_db - SPECTROGRAM_FLOOR_DB) / -SPECTROGRAM_FLOOR_DB * 255, 0, 255).astype(np.uint8)
+        return levels
+
+
+class SummaryBuilder:
+    """Pass-through dsp stage that builds both summaries of the signal flowing through it.
+
+    skip drops that many samples from the start, e.g. a chain's latency when
+    the builder sits after the chain.
+    """
+
+    def __init__(self, sample_rate, skip=0):
+        self.sample_rate = sample_rate
+        self.latency = 0
+        self.frames = 0
+        self.peaks = PeakBuilder()
+        self.spectrogram = SpectrogramBuilder(sample_rate)
+        self._skip = skip
+        self._channels = 0
+
+    def process(self, block):
+        self._channels = block.shape[1]
+        observed = block
+        if self._skip:
+            dropped = min(self._skip, len(block))
+            observed = block[dropped:]
+            self._skip -= dropped
+        if len(observed):
+            self.peaks.process(observed)
+            self.spectrogram.process(observed)
+            self.frames += len(observed)
+        return block
+
+    def flush(self):
+        return np.zeros((0, self._channels), dtype=np.float32)
+
+    def save(self, path):
+        arrays = {'info': np.array([self.sample_rate, self.frames, self.spectrogram.bands.shape[1]], dtype=np.int64)}
+        arrays.update({f"waveform_{size}": level for size, level in self.peaks.result().items()})
+        arrays.update({f"spectrogram_{size}": level for size, level in self.spectrogram.result().items()})
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with storage.atomic_write(path) as temp_path, open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+
+
+def summary_path(folder, kind, filename):
+    return os.path.join(folder, kind, f"{filename}.npz")
+
+
+def read_level(path, view, width):
+    # The coarsest level of a view ('waveform' or 'spectrogram') that still has
+    # at least width points, so one point is never stretched over several
+    # pixels. Returns (array, samples per point, info).
+    with np.load(path) as summary:
+        sizes = sorted(int(name.rsplit('_', 1)[1]) for name in summary.files if name.startswith(f"{view}_"))
+        if not sizes:
+            raise ValueError(f"Unknown summary view: {view}")
+        size = sizes[0]
+        for candidate in sizes:
+            if len(summary[f"{view}_{candidate}"]) >= width:
+                size = candidate
+        return summary[f"{view}_{size}"], size, summary['info']
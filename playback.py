@@ -0,0 +1,64 @@
+# playback.py
+import mmap
+import os
+from datetime import datetime, timezone
+from flask import Response, request
+from werkzeug.http import http_date, is_resource_modified
+
+# Stream stored audio straight from disk for the browser player. Files are
+# memory-mapped and sent in slices, and single byte ranges are answered with
+# 206 so the <audio> element can seek without downloading the file again.
+
+CHUNK_SIZE = 256 * 1024
+
+
+def _iter_mapped(path, start, stop):
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for offset in range(start, stop, CHUNK_SIZE):
+            yield mapped[offset:min(offset + CHUNK_SIZE, stop)]
+    finally:
+        mapped.close()
+
+
+def _if_range_matches(etag, mtime):
+    # A Range is ignored when If-Range names an older version of the file
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date.timestamp() >= int(mtime)
+    return True
+
+
+def stream_file(path, mimetype, max_age=3600):
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f"{stat.st_mtime_ns:x}-{size:x}"
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': f'public, max-age={max_age}',
+    }
+
+    last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    start, stop, status = 0, size, 200
+    byte_range = request.range
+    if byte_range is not None and _if_range_matches(etag, stat.st_mtime):
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    headers['Content-Length'] = str(stop - start)
+    body = _iter_mapped(path, start, stop) if stop > start else []
+    return Response(body, status=status, mimetype=mimetype, headers=headers, direct_passthrough=True)
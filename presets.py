@@ -0,0 +1,172 @@
+# presets.py
+import json
+import os
+import numpy as np
+from werkzeug.utils import secure_filename
+import dsp
+
+# Mastering presets. A preset is a JSON file in the presets folder holding an
+# ordered list of stage specs in the same style as stems.DEFAULT_STEM_CHAINS:
+# 'type' selects the processor and the other keys are its parameters, e.g.
+#
+#     {"name": "Warm", "stages": [
+#         {"type": "eq", "bands": [{"type": "low_shelf", "freq": 120, "gain_db": 1.5}]},
+#         {"type": "side_highpass", "cutoff_freq": 130},
+#         {"type": "limiter", "release_time": 30},
+#         {"type": "expander"}]}
+#
+# compile_chain turns a preset into one MasteringChain that runs every stage
+# per block in a single pass. Adjacent linear stages (EQ and gain) are fused
+# into one SOS cascade, and stages that would not change the signal are left
+# out. The loudness gain is applied by the first limiter, so it catches the
+# peaks the gain adds.
+
+PRESETS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presets')
+DEFAULT_PRESET = 'balanced'
+
+# Linear stages are fused into SOS cascades; the others map to one dsp processor each
+LINEAR_TYPES = ('eq', 'gain')
+STAGE_TYPES = LINEAR_TYPES + ('side_highpass', 'compressor', 'parallel_compressor', 'limiter', 'expander')
+
+# Cookbook band types whose response is flat at 0 dB gain
+GAIN_BANDS = ('peaking', 'low_shelf', 'high_shelf')
+
+
+def preset_names(folder=PRESETS_FOLDER):
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(folder) if name.endswith('.json'))
+
+
+def load_preset(quality=None, audio_type=None, folder=PRESETS_FOLDER):
+    # The most specific preset that exists: <quality>_<audio_type>, <quality>, then the default
+    candidates = []
+    if quality and audio_type:
+        candidates.append(f"{quality}_{audio_type}")
+    if quality:
+        candidates.append(quality)
+    candidates.append(DEFAULT_PRESET)
+
+    for name in candidates:
+        path = os.path.join(folder, f"{secure_filename(name.lower())}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                preset = json.load(f)
+            validate(preset)
+            return preset
+    raise ValueError(f"No mastering preset found in {folder}")
+
+
+def validate(preset):
+    if not isinstance(preset.get('stages'), list):
+        raise ValueError(f"Preset {preset.get('name')!r} has no list of stages")
+    for spec in preset['stages']:
+        if spec.get('type') not in STAGE_TYPES:
+            raise ValueError(f"Unknown preset stage type: {spec.get('type')}")
+
+
+def is_noop(spec, channels):
+    # Stages that would leave every sample unchanged
+    kind = spec['type']
+    if not spec.get('enabled', True):
+        return True
+    if kind == 'eq':
+        return all(band['type'] in GAIN_BANDS and band.get('gain_db', 0.0) == 0 for band in spec.get('bands', []))
+    if kind == 'gain':
+        return spec.get('gain_db', 0.0) == 0
+    if kind == 'side_highpass':
+        return channels != 2
+    if kind == 'compressor':
+        return spec.get('ratio', 4.0) == 1 and spec.get('makeup_db', 0.0) == 0
+    if kind == 'parallel_compressor':
+        return spec.get('blend', 0.5) == 0 or spec.get('ratio', 4.0) == 1
+    if kind == 'expander':
+        return spec.get('ratio', 1.5) == 1 or spec.get('range_db', 24.0) == 0
+    return False
+
+
+def _options(spec):
+    return {key: value for key, value in spec.items() if key not in ('type', 'enabled')}
+
+
+def _linear_sos(spec, sample_rate):
+    # SOS rows and a scalar gain for a linear stage
+    if spec['type'] == 'gain':
+        return np.zeros((0, 6)), 10 ** (spec.get('gain_db', 0.0) / 20)
+    bands = [band for band in spec.get('bands', [])
+             if band['type'] not in GAIN_BANDS or band.get('gain_db', 0.0) != 0]
+    rows = [dsp.biquad_sos(band['type'], band['freq'], sample_rate, band.get('gain_db', 0.0), band.get('q', 0.7071))
+            for band in bands]
+    return (np.concatenate(rows) if rows else np.zeros((0, 6))), 1.0
+
+
+def _fuse(specs, sample_rate, channels):
+    # One SOS cascade for a run of linear stages; the scalar gain scales the first section's numerator
+    rows = []
+    gain = 1.0
+    for spec in specs:
+        sos, scale = _linear_sos(spec, sample_rate)
+        rows.append(sos)
+        gain *= scale
+    sos = np.concatenate(rows)
+    if not len(sos):
+        return dsp.Gain(sample_rate, channels, 20 * np.log10(gain)) if gain != 1.0 else None
+    sos = sos.copy()
+    sos[0, :3] *= gain
+    return dsp.SosFilter(sos, channels)
+
+
+def _build(spec, sample_rate, channels, gain_db=0.0):
+    options = _options(spec)
+    kind = spec['type']
+    if kind == 'side_highpass':
+        return dsp.SideHighPass(sample_rate, channels, **options)
+    if kind == 'compressor':
+        return dsp.Compressor(sample_rate, channels, **options)
+    if kind == 'parallel_compressor':
+        return dsp.ParallelCompressor(sample_rate, channels, **options)
+    if kind == 'limiter':
+        options['gain_db'] = options.get('gain_db', 0.0) + gain_db
+        return dsp.LookaheadLimiter(sample_rate, channels, **options)
+    if kind == 'expander':
+        return dsp.MultibandExpander(sample_rate, channels, **options)
+    raise ValueError(f"Unknown preset stage type: {kind}")
+
+
+def compile_chain(preset, sample_rate, channels, gain_db=0.0, eq_taps=None, parallel_compression=False):
+    # Build the processing graph for a preset. eq_taps (a reference-matching
+    # FIR) runs first and parallel_compression inserts the default parallel
+    # compressor after it, as the mastering options ask for.
+    specs = [spec for spec in preset['stages'] if not is_noop(spec, channels)]
+    if parallel_compression and not any(spec['type'] == 'parallel_compressor' for spec in specs):
+        specs.insert(0, {'type': 'parallel_compressor', 'blend': 0.5, 'threshold_db': -18.0, 'ratio': 4.0,
+                         'attack_ms': 10.0, 'release_ms': 100.0})
+
+    # Without a limiter the loudness gain is a plain gain stage, which fuses with any EQ in front
+    if gain_db and not any(spec['type'] == 'limiter' for spec in specs):
+        specs.insert(0, {'type': 'gain', 'gain_db': gain_db})
+        gain_db = 0.0
+
+    stages = [dsp.FirFilter(eq_taps, channels)] if eq_taps is not None else []
+    linear = []
+    for spec in specs:
+        if spec['type'] in LINEAR_TYPES:
+            linear.append(spec)
+            continue
+
+        if linear:
+            fused = _fuse(linear, sample_rate, channels)
+            linear = []
+            if isinstance(fused, dsp.Gain) and spec['type'] == 'limiter':
+                # The limiter applies its input gain itself, so a bare gain folds into it
+                gain_db += 20 * np.log10(fused.gain)
+            elif fused is not None:
+                stages.append(fused)
+
+        stages.append(_build(spec, sample_rate, channels, gain_db if spec['type'] == 'limiter' else 0.0))
+        if spec['type'] == 'limiter':
+            gain_db = 0.0
+
+    if linear:
+        fused = _fuse(linear, sample_rate, channels)
+        if fused is not None:
+            stages.append(fused)
+    return dsp.MasteringChain(stages)
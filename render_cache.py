@@ -0,0 +1,142 @@
+# render_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import delivery
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def new_digest():
+    # The hash behind file_digest, for callers that see the bytes incrementally
+    return hashlib.blake2b(digest_size=20)
+
+
+def file_digest(filepath):
+    digest = new_digest()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(filepath, params):
+    # The key covers the audio bytes and every parameter that affects the render
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(file_digest(filepath).encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """LRU index of mastered renders stored in the output folder.
+
+    The index is an SQLite database next to the renders, so pool workers in
+    different processes can share it; every read-modify-write runs in an
+    immediate transaction.
+    """
+
+    def __init__(self, output_folder, max_bytes, on_evict=None):
+        self.output_folder = output_folder
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict  # Called with the filename of each evicted render
+        self.db_path = os.path.join(output_folder, 'render_cache.db')
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._schema_ready:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS renders (
+                    key TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS renders_last_used ON renders (last_used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+            self._schema_ready = True
+        return conn
+
+    def lookup(self, key):
+        # Return the cached output filename for key, or None on a miss
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT filename FROM renders WHERE key = ?', (key,)).fetchone()
+            if row is not None and not os.path.exists(os.path.join(self.output_folder, row[0])):
+                # The render was removed behind our back
+                conn.execute('DELETE FROM renders WHERE key = ?', (key,))
+                row = None
+
+            if row is None:
+                conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'misses'")
+            else:
+                conn.execute('UPDATE renders SET last_used = ? WHERE key = ?', (time.time(), key))
+                conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+            conn.execute('COMMIT')
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def add(self, key, filename):
+        # Register a finished render and return the filename to serve. If another
+        # worker cached the same key meanwhile, its render wins and ours is removed.
+        filepath = os.path.join(self.output_folder, filename)
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT filename FROM renders WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[0] != filename and os.path.exists(os.path.join(self.output_folder, row[0])):
+                conn.execute('UPDATE renders SET last_used = ? WHERE key = ?', (time.time(), key))
+                conn.execute('COMMIT')
+                os.remove(filepath)
+                return row[0]
+
+            conn.execute('INSERT OR REPLACE INTO renders (key, filename, size, last_used) VALUES (?, ?, ?, ?)',
+                         (key, filename, os.path.getsize(filepath), time.time()))
+            evicted = self._evict(conn, keep=key)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.output_folder, name))
+            except FileNotFoundError:
+                pass
+            delivery.remove_renditions(self.output_folder, name)
+            if self.on_evict is not None:
+                self.on_evict(name)
+        return filename
+
+    def _evict(self, conn, keep):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM renders').fetchone()[0]
+        evicted = []
+        if total <= self.max_bytes:
+            return evicted
+
+        for key, filename, size in conn.execute('SELECT key, filename, size FROM renders WHERE key != ? ORDER BY last_used',
+                                                (keep,)).fetchall():
+            conn.execute('DELETE FROM renders WHERE key = ?', (key,))
+            evicted.append(filename)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+        conn.execute("UPDATE counters SET value = value + ? WHERE name = 'evictions'", (len(evicted),))
+        return evicted
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            stats = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+            stats['entries'], stats['bytes'] = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM renders').fetchone()
+            stats['max_bytes'] = self.max_bytes
+            return stats
+        finally:
+            conn.close()
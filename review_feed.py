@@ -0,0 +1,155 @@
+# review_feed.py
+import atexit
+import os
+import sqlite3
+import threading
+import time
+import database
+
+# Durability modes for submitted reviews:
+#   'sync'  - every review is committed on its own before the request returns
+#   'group' - the request waits until the batch holding its review is committed
+#   'async' - the request returns once the review is buffered; reviews still in
+#             the buffer are lost if the process dies
+DURABILITY_MODES = ('sync', 'group', 'async')
+
+
+class _PendingReview:
+    __slots__ = ('row', 'done', 'error')
+
+    def __init__(self, author, content):
+        self.row = (author, content)
+        self.done = threading.Event()
+        self.error = None
+
+
+class ReviewWriter:
+    """Buffers review submissions and commits them in batched transactions.
+
+    A batch is flushed when ``batch_size`` reviews are waiting or every
+    ``flush_interval`` seconds, whichever comes first. ``on_commit`` is
+    called after each committed batch.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.05, durability='group', on_commit=None):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown review durability mode: {durability}")
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.on_commit = on_commit
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, author, content):
+        if self.durability == 'sync':
+            database.insert_review(author, content)
+            self._committed()
+            return
+
+        pending = _PendingReview(author, content)
+        with self._lock:
+            self._buffer.append(pending)
+            full = len(self._buffer) >= self.batch_size
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+
+        if self.durability == 'group':
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+
+        try:
+            database.insert_reviews([pending.row for pending in batch])
+        except sqlite3.IntegrityError:
+            # One bad row rolls back the whole batch; insert them one by one so only it fails
+            self._insert_each(batch)
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        else:
+            self._committed()
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+    def _insert_each(self, batch):
+        committed = False
+        for pending in batch:
+            try:
+                database.insert_review(*pending.row)
+                committed = True
+            except Exception as e:
+                pending.error = e
+        if committed:
+            self._committed()
+
+    def _committed(self):
+        if self.on_commit is not None:
+            self.on_commit()
+
+    def _ensure_started(self):
+        # The flusher thread does not survive a fork, so start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='review-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(timeout=self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+class ReviewFeedCache:
+    """Holds the pre-rendered first page of reviews.
+
+    The local ReviewWriter invalidates it on every commit; ``ttl`` bounds how
+    long reviews committed by other server processes can go unseen.
+    """
+
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self._entry = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, render):
+        # render() returns the value to cache, e.g. (html, next_cursor)
+        entry = self._entry
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        with self._lock:
+            entry = self._entry
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                return entry[1]
+            generation = self._generation
+            rendered_at = time.monotonic()
+            value = render()
+            # A commit during rendering makes this value stale, so do not keep it
+            if generation == self._generation:
+                self._entry = (rendered_at, value)
+            return value
+
+    def invalidate(self):
+        self._generation += 1
+        self._entry = None
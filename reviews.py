@@ -1,6 +1,16 @@
 # reviews.py
 class Review:
-    def __init__(self, content, author, timestamp):
+    # One review per row on every page, so keep instances small
+    __slots__ = ('id', 'content', 'author', 'timestamp')
+
+    def __init__(self, content, author, timestamp, id=None):
+        # Slots have no defaults, so set them all before validating; a row that
+        # fails validation must still render instead of raising AttributeError
+        self.id = id
+        self.content = content if content is not None else ''
+        self.author = author if author is not None else ''
+        self.timestamp = timestamp if timestamp is not None else ''
+
         try:
             if not content:
                 raise ValueError("Review content cannot be empty")
@@ -8,11 +18,15 @@ class Review:
                 raise ValueError("Review author cannot be empty")
             if not timestamp:
                 raise ValueError("Review timestamp cannot be empty")
-
-            self.content = content
-            self.author = author
-            self.timestamp = timestamp
         except ValueError as e:
             # Handle the validation error here, such as logging it or raising a custom exception
             # For this simple example, we'll just print the error
             print(f"Error creating a review: {e}")
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'author': self.author,
+            'content': self.content,
+            'timestamp': str(self.timestamp),
+        }
@@ -0,0 +1,144 @@
+# separation.py
+import hashlib
+import os
+import threading
+import numpy as np
+import storage
+
+# Long-lived Spleeter source separation. The TensorFlow model is loaded and
+# warmed up once per process, audio is separated in overlapping windows that
+# are crossfaded back together so memory stays bounded on long tracks, and
+# the stems can be cached on disk by input hash. All five stems of a track
+# take about 0.5 GB, so the cache is opt-in: the caller passes an output
+# folder and the StorageManager indexing it, and the manager's quota is
+# enforced after every write.
+
+SPLEETER_SAMPLE_RATE = 44100
+STEMS_FOLDER = 'stems'
+
+
+class SeparationService:
+    def __init__(self, model='spleeter:5stems', window_seconds=30.0, overlap_seconds=1.0, output_folder=None,
+                 storage=None):
+        if output_folder and storage is None:
+            raise ValueError('The stem cache needs a StorageManager to bound its size')
+        self.model = model
+        self.window = int(window_seconds * SPLEETER_SAMPLE_RATE)
+        self.overlap = int(overlap_seconds * SPLEETER_SAMPLE_RATE)
+        self.output_folder = output_folder  # Stems are cached under <output_folder>/stems; None disables the cache
+        self.storage = storage  # StorageManager with output_folder as its 'output' area
+        self._separator = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        # Build the model and run one short separation so the graph is compiled
+        with self._lock:
+            if self._separator is None:
+                from spleeter.separator import Separator
+
+                separator = Separator(self.model)
+                separator.separate(np.zeros((SPLEETER_SAMPLE_RATE, 2), dtype=np.float32))
+                self._separator = separator
+        return self._separator
+
+    def cache_key(self, waveform):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{self.model}:{self.window}:{self.overlap}:{waveform.shape}:{waveform.dtype}".encode())
+        digest.update(np.ascontiguousarray(waveform).data)
+        return digest.hexdigest()
+
+    def separate(self, waveform):
+        # Return {stem name: array shaped like a stereo waveform}
+        waveform = np.asarray(waveform, dtype=np.float32)
+        if waveform.ndim == 1:
+            waveform = np.stack([waveform, waveform], axis=1)
+
+        key = self.cache_key(waveform) if self.output_folder else None
+        if key is not None:
+            stems = self._load_cached(key)
+            if stems is not None:
+                return stems
+
+        stems = self._separate_windows(waveform)
+        if key is not None:
+            self._store_cached(key, stems)
+        return stems
+
+    def _separate_windows(self, waveform):
+        separator = self.load()
+        length = len(waveform)
+        if length <= self.window:
+            with self._lock:
+                return {name: stem.astype(np.float32) for name, stem in separator.separate(waveform).items()}
+
+        hop = self.window - self.overlap
+        fade_in = np.linspace(0.0, 1.0, self.overlap, endpoint=False, dtype=np.float32)[:, None]
+        stems = None
+
+        for start in range(0, length - self.overlap, hop):
+            stop = min(start + self.window, length)
+            with self._lock:
+                window_stems = separator.separate(waveform[start:stop])
+
+            if stems is None:
+                stems = {name: np.zeros((length, stem.shape[1]), dtype=np.float32) for name, stem in window_stems.items()}
+
+            # Linear crossfades over the overlap; each pair of ramps sums to one
+            for name, stem in window_stems.items():
+                stem = stem[:stop - start].astype(np.float32)
+                if start > 0:
+                    stem[:self.overlap] *= fade_in
+                if stop < length:
+                    stem[-self.overlap:] *= 1.0 - fade_in
+                stems[name][start:stop] += stem
+
+        return stems
+
+    def _cache_path(self, key):
+        # (storage name, path) of the cached stems of an input
+        name = f"{STEMS_FOLDER}/{key}.npy"
+        return name, os.path.join(self.output_folder, name)
+
+    def _load_cached(self, key):
+        path = self.storage.lookup('output', self._cache_path(key)[0])
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            stems = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        return {stem: stems[stem] for stem in stems.dtype.names}
+
+    def _store_cached(self, key, stems):
+        # All stems of an input go in one .npy of records, one field per stem, so
+        # eviction removes a whole set and readers still memory-map it
+        name, path = self._cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        length, channels = next(iter(stems.values())).shape
+        dtype = np.dtype([(stem, np.float32, (channels,)) for stem in stems])
+        with storage.atomic_write(path) as temp_path:
+            cached = np.lib.format.open_memmap(temp_path, mode='w+', dtype=dtype, shape=(length,))
+            for stem_name, stem in stems.items():
+                cached[stem_name] = stem
+            cached.flush()
+            del cached
+        self.storage.register('output', name)
+        self.storage.evict()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service(**options):
+    # One service per process; options only apply when it is first created
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = SeparationService(**options)
+        return _service
+
+
+def warm_up(**options):
+    # Suitable as a process pool initializer
+    get_service(**options).load()
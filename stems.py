@@ -0,0 +1,97 @@
+# stems.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import dsp
+
+# Per-stem processing after source separation. Every stem runs its own
+# chain in a worker thread (the SciPy filters release the GIL) and the
+# results are summed block by block into one preallocated mix buffer.
+
+BLOCK_SIZE = 65536
+
+# Stage specs per Spleeter 5-stem name; 'type' selects the dsp processor
+DEFAULT_STEM_CHAINS = {
+    'vocals': [
+        {'type': 'eq', 'bands': [{'type': 'highpass', 'freq': 80},
+                                 {'type': 'peaking', 'freq': 3000, 'gain_db': 1.5, 'q': 1.0}]},
+        {'type': 'compressor', 'threshold_db': -18.0, 'ratio': 3.0, 'attack_ms': 5.0, 'release_ms': 80.0},
+        {'type': 'limiter', 'ceiling_db': -1.0, 'release_time': 50},
+    ],
+    'drums': [
+        {'type': 'eq', 'bands': [{'type': 'peaking', 'freq': 60, 'gain_db': 1.0, 'q': 1.0},
+                                 {'type': 'high_shelf', 'freq': 8000, 'gain_db': 1.0}]},
+        {'type': 'compressor', 'threshold_db': -15.0, 'ratio': 4.0, 'attack_ms': 10.0, 'release_ms': 120.0},
+        {'type': 'limiter', 'ceiling_db': -1.0, 'release_time': 30},
+    ],
+    'bass': [
+        {'type': 'eq', 'bands': [{'type': 'highpass', 'freq': 30},
+                                 {'type': 'low_shelf', 'freq': 100, 'gain_db': 1.0}]},
+        {'type': 'compressor', 'threshold_db': -20.0, 'ratio': 4.0, 'attack_ms': 20.0, 'release_ms': 150.0},
+        {'type': 'limiter', 'ceiling_db': -1.0, 'release_time': 100},
+    ],
+    'piano': [
+        {'type': 'eq', 'bands': [{'type': 'peaking', 'freq': 400, 'gain_db': -1.0, 'q': 1.0}]},
+        {'type': 'compressor', 'threshold_db': -20.0, 'ratio': 2.0, 'attack_ms': 15.0, 'release_ms': 150.0},
+    ],
+    'other': [
+        {'type': 'compressor', 'threshold_db': -22.0, 'ratio': 2.0, 'attack_ms': 15.0, 'release_ms': 150.0},
+    ],
+}
+
+
+def build_stage(spec, sample_rate, channels):
+    options = {key: value for key, value in spec.items() if key != 'type'}
+    if spec['type'] == 'eq':
+        return dsp.ParametricEQ(sample_rate, channels, **options)
+    if spec['type'] == 'compressor':
+        return dsp.Compressor(sample_rate, channels, **options)
+    if spec['type'] == 'limiter':
+        return dsp.LookaheadLimiter(sample_rate, channels, **options)
+    if spec['type'] == 'gain':
+        return dsp.Gain(sample_rate, channels, **options)
+    raise ValueError(f"Unknown stem stage type: {spec['type']}")
+
+
+def build_chain(specs, sample_rate, channels):
+    return dsp.MasteringChain([build_stage(spec, sample_rate, channels) for spec in specs])
+
+
+def _accumulate(mix, lock, block, write):
+    # Add a processed block into the mix at write, dropping latency before 0 and tail past the end
+    end = write + len(block)
+    lo = max(write, 0)
+    hi = min(end, len(mix))
+    if hi > lo:
+        with lock:
+            mix[lo:hi] += block[lo - write:hi - write]
+    return end
+
+
+def _process_into(mix, lock, stem, chain, block_size):
+    write = -chain.latency
+    for start in range(0, len(stem), block_size):
+        block = np.asarray(stem[start:start + block_size], dtype=np.float32)
+        write = _accumulate(mix, lock, chain.process(block), write)
+    _accumulate(mix, lock, chain.flush(), write)
+
+
+def process_stems(stems, sample_rate, chains=None, workers=None, block_size=BLOCK_SIZE):
+    # Process every stem with its chain in parallel and return the remix.
+    # Stems without a chain are mixed in unprocessed.
+    chains = DEFAULT_STEM_CHAINS if chains is None else chains
+    first = next(iter(stems.values()))
+    channels = first.shape[1] if first.ndim > 1 else 1
+    mix = np.zeros((len(first), channels), dtype=np.float32)
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=workers or len(stems)) as executor:
+        futures = []
+        for name, stem in stems.items():
+            stem = stem if stem.ndim > 1 else stem[:, None]
+            chain = build_chain(chains.get(name, []), sample_rate, channels)
+            futures.append(executor.submit(_process_into, mix, lock, stem, chain, block_size))
+        for future in futures:
+            future.result()
+
+    return mix
@@ -0,0 +1,245 @@
+# storage.py
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+# Disk lifecycle for the upload and output folders. Every stored file has a
+# row in an SQLite index (area, relative name, size, last use), shared by the
+# web processes and the mastering workers. Lookups read the index instead of
+# probing the disk and mark the file as used. A background sweep reconciles
+# the index with the folders, then evicts files unused for longer than the
+# age limit and, least recently used first, files past the size quota. Files
+# used within the grace period and files that queued or running jobs still
+# need are never evicted.
+
+TOUCH_INTERVAL = 60.0  # seconds; lookups within this long of the last recorded use do not write
+TEMP_MAX_AGE = 24 * 3600  # temporary files left by crashed writers are removed after this long
+SKIPPED_FOLDERS = ('.sessions',)  # resumable upload sessions, which UploadManager expires itself
+
+# Temporary files written by atomic_write next to their destination, e.g. "x.wav.<uuid hex>.partial"
+TEMP_FILE = re.compile(r'\.[0-9a-f]{32}\.partial$')
+DATABASE_FILE = re.compile(r'\.db(-journal|-wal|-shm)?$')
+
+
+def unique_name(filename):
+    # A per-upload name, so files uploaded under the same name never overwrite each other
+    return f"{uuid.uuid4().hex[:12]}_{secure_filename(filename)}"
+
+
+@contextmanager
+def atomic_write(path):
+    # Yield a temporary path next to path, renamed over path only when the body succeeds,
+    # so readers see either the previous file or the complete new one
+    temp_path = f"{path}.{uuid.uuid4().hex}.partial"
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class StorageManager:
+    """Index, quota and eviction for the files under ``folders`` ({area: folder}).
+
+    protected is a callable returning the (area, name) pairs that must be kept
+    whatever their age, e.g. JobQueue.active_files, or None when they cannot
+    be determined right now, in which case nothing is evicted.
+    """
+
+    def __init__(self, db_path, folders, max_bytes=0, max_age=None, min_age=15 * 60, sweep_interval=60.0,
+                 protected=None):
+        self.db_path = db_path
+        self.folders = dict(folders)
+        self.max_bytes = max_bytes  # 0 disables the size quota
+        self.max_age = max_age  # seconds since last use, None disables the age limit
+        self.min_age = min_age  # grace period after the last use
+        self.sweep_interval = sweep_interval
+        self.protected = protected
+        self._schema_ready = False
+        self._sweeper = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._schema_ready:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    area TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (area, name)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('evictions', 0), ('evicted_bytes', 0)")
+            self._schema_ready = True
+        return conn
+
+    def path(self, area, name):
+        return os.path.join(self.folders[area], name)
+
+    def register(self, area, name):
+        # Record a file that was just written (or rewritten) as used now
+        size = os.path.getsize(self.path(area, name))
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO files (area, name, size, last_used) VALUES (?, ?, ?, ?)',
+                         (area, name, size, time.time()))
+        finally:
+            conn.close()
+
+    def forget(self, area, name):
+        # Drop the row of a file that was removed by someone else
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM files WHERE area = ? AND name = ?', (area, name))
+        finally:
+            conn.close()
+
+    def lookup(self, area, name):
+        # Path of a stored file or None, marking the file as used. Files written
+        # without register() (or before the index existed) are picked up here.
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT last_used FROM files WHERE area = ? AND name = ?', (area, name)).fetchone()
+            if row is not None:
+                if now - row[0] > TOUCH_INTERVAL:
+                    conn.execute('UPDATE files SET last_used = ? WHERE area = ? AND name = ?', (now, area, name))
+                return self.path(area, name)
+        finally:
+            conn.close()
+
+        if not os.path.isfile(self.path(area, name)):
+            return None
+        self.register(area, name)
+        return self.path(area, name)
+
+    def _walk(self, area):
+        # {relative name: (size, mtime)} of the stored files in an area, removing stale temporary files
+        files = {}
+        folder = self.folders[area]
+        now = time.time()
+        for root, directories, names in os.walk(folder):
+            directories[:] = [directory for directory in directories if directory not in SKIPPED_FOLDERS]
+            for filename in names:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                    if TEMP_FILE.search(filename):
+                        if now - stat.st_mtime > TEMP_MAX_AGE:
+                            os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if DATABASE_FILE.search(filename):
+                    continue
+                files[os.path.relpath(path, folder).replace(os.sep, '/')] = (stat.st_size, stat.st_mtime)
+        return files
+
+    def scan(self):
+        # Bring the index in line with the folders: adopt new files, refresh sizes, drop vanished ones
+        on_disk = {(area, name): entry for area in self.folders for name, entry in self._walk(area).items()}
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            indexed = {(area, name): size for area, name, size in conn.execute('SELECT area, name, size FROM files')}
+            for key in indexed.keys() - on_disk.keys():
+                conn.execute('DELETE FROM files WHERE area = ? AND name = ?', key)
+            for key, (size, mtime) in on_disk.items():
+                if key not in indexed:
+                    conn.execute('INSERT INTO files (area, name, size, last_used) VALUES (?, ?, ?, ?)', (*key, size, mtime))
+                elif indexed[key] != size:
+                    conn.execute('UPDATE files SET size = ? WHERE area = ? AND name = ?', (size, *key))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def evict(self):
+        # Remove expired files, then least recently used ones until under the quota; returns the (area, name) removed
+        protected = self.protected() if self.protected is not None else set()
+        if protected is None:
+            logger.warning('Files in use are unknown; skipping eviction')
+            return []
+        protected = set(protected)
+        now = time.time()
+        evicted = []
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+            for area, name, size, last_used in conn.execute('SELECT area, name, size, last_used FROM files '
+                                                            'ORDER BY last_used').fetchall():
+                if now - last_used < self.min_age:
+                    break  # Everything after this was used even more recently
+                expired = self.max_age is not None and now - last_used > self.max_age
+                if not expired and (not self.max_bytes or total <= self.max_bytes):
+                    break
+                if (area, name) in protected:
+                    continue
+                conn.execute('DELETE FROM files WHERE area = ? AND name = ?', (area, name))
+                evicted.append((area, name, size))
+                total -= size
+            conn.execute("UPDATE counters SET value = value + ? WHERE name = 'evictions'", (len(evicted),))
+            conn.execute("UPDATE counters SET value = value + ? WHERE name = 'evicted_bytes'",
+                         (sum(size for _, _, size in evicted),))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+        # The rows go first, so a lookup racing with the removal sees the file as gone
+        for area, name, _ in evicted:
+            try:
+                os.remove(self.path(area, name))
+            except FileNotFoundError:
+                pass
+        return [(area, name) for area, name, _ in evicted]
+
+    def sweep(self):
+        self.scan()
+        evicted = self.evict()
+        if evicted:
+            logger.info('Evicted %d stored file(s)', len(evicted))
+        return evicted
+
+    def start(self):
+        with self._start_lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='storage-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _sweep_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception:
+                # A failed sweep (e.g. a locked index) is retried on the next interval
+                logger.exception('Storage sweep failed')
+            self._stop.wait(self.sweep_interval)
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            stats = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+            stats['files'], stats['bytes'] = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files').fetchone()
+            stats['max_bytes'] = self.max_bytes
+            stats['max_age'] = self.max_age
+            return stats
+        finally:
+            conn.close()
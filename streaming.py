@@ -0,0 +1,245 @@
+# streaming.py
+import struct
+import subprocess
+import tempfile
+import threading
+import numpy as np
+import instrumentation
+from pydub.utils import get_encoder_name, mediainfo_json
+
+# Decode and encode audio through ffmpeg pipes as raw float32 frames, so a
+# file of any length can be processed with a fixed amount of memory.
+
+DEFAULT_BLOCK_SIZE = 65536  # frames
+
+
+class StreamInfo:
+    def __init__(self, sample_rate, channels, duration):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.duration = duration
+
+    @property
+    def frames(self):
+        return int(self.duration * self.sample_rate)
+
+
+def probe(filepath):
+    info = mediainfo_json(filepath)
+    stream = next(s for s in info['streams'] if s.get('codec_type') == 'audio')
+    duration = stream.get('duration') or info.get('format', {}).get('duration') or 0
+    return StreamInfo(int(stream['sample_rate']), int(stream['channels']), float(duration))
+
+
+def decode_blocks(filepath, block_size=DEFAULT_BLOCK_SIZE, sample_rate=None, channels=None, start=None, duration=None):
+    # Yield float32 blocks shaped (frames, channels); only the last block may be shorter
+    if sample_rate is None or channels is None:
+        info = probe(filepath)
+        sample_rate = sample_rate or info.sample_rate
+        channels = channels or info.channels
+
+    command = [get_encoder_name(), '-v', 'error', '-nostdin']
+    if start is not None:
+        command += ['-ss', str(start)]
+    if duration is not None:
+        command += ['-t', str(duration)]
+    command += ['-i', filepath, '-f', 'f32le', '-acodec', 'pcm_f32le',
+                '-ac', str(channels), '-ar', str(sample_rate), '-']
+
+    frame_bytes = 4 * channels
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(block_size * frame_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % frame_bytes
+            yield np.frombuffer(data[:usable], dtype=np.float32).reshape(-1, channels)
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError(f'Decoding failed: {process.stderr.read().decode(errors="replace").strip()}')
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stderr.close()
+
+
+def read_audio(filepath, sample_rate=None, channels=None, start=None, duration=None):
+    # Decode a whole file (or an excerpt) into one float32 array
+    if sample_rate is None or channels is None:
+        info = probe(filepath)
+        sample_rate = sample_rate or info.sample_rate
+        channels = channels or info.channels
+
+    blocks = list(decode_blocks(filepath, sample_rate=sample_rate, channels=channels, start=start, duration=duration))
+    if not blocks:
+        return np.zeros((0, channels), dtype=np.float32), sample_rate
+    return np.concatenate(blocks), sample_rate
+
+
+class StreamEncoder:
+    """Write float32 blocks to an ffmpeg process that encodes them to a file."""
+
+    def __init__(self, filepath, sample_rate, channels, format='wav', codec='pcm_s24le', parameters=None):
+        command = [get_encoder_name(), '-v', 'error', '-nostdin', '-y',
+                   '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels), '-i', '-',
+                   '-acodec', codec] + list(parameters or []) + ['-f', format, filepath]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, block):
+        if len(block):
+            self.process.stdin.write(np.ascontiguousarray(np.clip(block, -1.0, 1.0), dtype=np.float32).tobytes())
+
+    def close(self):
+        if self.process.returncode is not None:
+            return
+        self.process.stdin.close()
+        error = self.process.stderr.read()
+        self.process.stderr.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f'Encoding failed: {error.decode(errors="replace").strip()}')
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stderr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class IncrementalDecoder:
+    """Decode a file while its bytes are still arriving.
+
+    Bytes passed to feed() go to ffmpeg's stdin. A reader thread parses the
+    WAV stream ffmpeg writes back, which carries the sample rate and channel
+    count, and calls on_block(block, sample_rate, channels) with float32
+    blocks shaped (frames, channels).
+    """
+
+    def __init__(self, on_block, block_size=DEFAULT_BLOCK_SIZE):
+        command = [get_encoder_name(), '-v', 'error', '-i', 'pipe:0', '-f', 'wav', '-acodec', 'pcm_f32le', 'pipe:1']
+        # Errors go to a file: a full stderr pipe would stall ffmpeg, and with it feed()
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self._stderr)
+        self.on_block = on_block
+        self.block_size = block_size
+        self.error = None
+        self._reader = threading.Thread(target=self._read, name='incremental-decoder', daemon=True)
+        self._reader.start()
+
+    def _read_header(self):
+        stdout = self.process.stdout
+        if stdout.read(12)[8:12] != b'WAVE':
+            raise RuntimeError('Decoder did not produce a WAV stream')
+        channels = sample_rate = None
+        while True:
+            chunk = stdout.read(8)
+            if len(chunk) < 8:
+                raise RuntimeError('Decoder output ended before the audio data')
+            chunk_id, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if chunk_id == b'data':
+                return sample_rate, channels
+            body = stdout.read(size + size % 2)
+            if chunk_id == b'fmt ':
+                channels, sample_rate = struct.unpack('<HI', body[2:8])
+
+    def _read(self):
+        try:
+            sample_rate, channels = self._read_header()
+            frame_bytes = 4 * channels
+            while True:
+                data = self.process.stdout.read(self.block_size * frame_bytes)
+                if not data:
+                    break
+                usable = len(data) - len(data) % frame_bytes
+                self.on_block(np.frombuffer(data[:usable], dtype=np.float32).reshape(-1, channels), sample_rate, channels)
+        except Exception as e:
+            # Stop ffmpeg so feed() cannot block on a pipe nobody reads
+            self.error = e
+            self.process.kill()
+
+    def feed(self, data):
+        if self.error is None:
+            try:
+                self.process.stdin.write(data)
+            except (BrokenPipeError, ValueError) as e:
+                self.error = e
+
+    def close(self):
+        # Wait for the last blocks; raises if decoding or on_block failed
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._reader.join()
+        self.process.stdout.close()
+        returncode = self.process.wait()
+        self._stderr.seek(0)
+        error = self._stderr.read()
+        self._stderr.close()
+        if returncode != 0 and self.error is None:
+            self.error = RuntimeError(f'Decoding failed: {error.decode(errors="replace").strip()}')
+        if self.error is not None:
+            raise self.error
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+        self._reader.join()
+        for pipe in (self.process.stdin, self.process.stdout, self._stderr):
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+
+def process_stream(processor, input_filepath, output_filepath, block_size=DEFAULT_BLOCK_SIZE, progress=None, **encoder_options):
+    # Run a dsp processor over a file block by block. The processor's latency
+    # is dropped from the start and its tail is flushed at the end, so the
+    # result matches dsp.run_whole on the fully decoded signal.
+    info = probe(input_filepath)
+    skip = processor.latency
+    done = 0
+
+    # Decoding and encoding interleave with processing, so their time is summed per block
+    decode = instrumentation.Accumulator('decode', info.sample_rate)
+    encode = instrumentation.Accumulator('encode', info.sample_rate)
+    blocks = decode_blocks(input_filepath, block_size, info.sample_rate, info.channels)
+
+    with StreamEncoder(output_filepath, info.sample_rate, info.channels, **encoder_options) as encoder:
+        while True:
+            with decode.measure():
+                block = next(blocks, None)
+            if block is None:
+                break
+            decode.frames += len(block)
+
+            out = processor.process(block)
+            if skip:
+                dropped = min(skip, len(out))
+                out = out[dropped:]
+                skip -= dropped
+            with encode.measure(len(out)):
+                encoder.write(out)
+
+            done += len(block)
+            if progress is not None and info.frames:
+                progress(min(done / info.frames, 1.0))
+
+        tail = processor.flush()[skip:]
+        with encode.measure(len(tail)):
+            encoder.write(tail)
+            encoder.close()
+
+    decode.finish()
+    encode.finish()
+    return info
@@ -0,0 +1,261 @@
+# uploads.py
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from werkzeug.utils import secure_filename
+from render_cache import new_digest
+from storage import unique_name
+
+# Resumable chunked uploads. Each part is written straight to a .part file
+# in the sessions folder; the offset is the size of that file, so an
+# interrupted upload resumes from whatever reached the disk. While the parts
+# arrive in order, the process receiving them also feeds an incremental
+# decoder and measures loudness, so the measurement is cached by the time
+# the last byte lands and mastering does not decode the upload again.
+
+SESSIONS_FOLDER = '.sessions'
+SNIFF_BYTES = 12
+COPY_SIZE = 1 << 20
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff_format(header):
+    # Identify WAV or MP3 from the first bytes of a file, or return None
+    if len(header) >= 12 and header[:4] in (b'RIFF', b'RF64') and header[8:12] == b'WAVE':
+        return 'wav'
+    if header[:3] == b'ID3':
+        return 'mp3'
+    # Bare MPEG audio frame: 11 sync bits, then a valid version and layer
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0 \
+            and (header[1] >> 3) & 0x3 != 0x1 and (header[1] >> 1) & 0x3 != 0:
+        return 'mp3'
+    return None
+
+
+def has_allowed_extension(filename, extensions=('mp3', 'wav')):
+    # Checked before anything touches the AudioProcessor, so it needs no DSP imports
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
+
+
+def sniff_stream(stream):
+    # Peek at an uploaded file's header without consuming it
+    position = stream.tell()
+    header = stream.read(SNIFF_BYTES)
+    stream.seek(position)
+    return sniff_format(header)
+
+
+class _LiveAnalysis:
+    """Hash and loudness measurement of an upload, built as its parts arrive in order."""
+
+    def __init__(self, cache_dir, block_size):
+        import loudness
+        import streaming
+
+        self.cache_dir = cache_dir
+        self.digest = new_digest()
+        self.offset = 0
+        self.fed_at = time.monotonic()
+        self.meter = None
+        self._loudness = loudness
+        self.decoder = streaming.IncrementalDecoder(self._on_block, block_size)
+
+    def _on_block(self, block, sample_rate, channels):
+        if self.meter is None:
+            self.meter = self._loudness.LoudnessMeter(sample_rate, channels)
+        self.meter.process(block)
+
+    def feed(self, data):
+        self.digest.update(data)
+        self.decoder.feed(data)
+        self.offset += len(data)
+        self.fed_at = time.monotonic()
+
+    def finish(self):
+        # Keyed by the same digest as render_cache.file_digest, where mastering looks it up
+        self.decoder.close()
+        if self.meter is not None:
+            self._loudness.store_cached(self.cache_dir, self.digest.hexdigest(), self.meter.result())
+
+
+class UploadManager:
+    """Resumable uploads stored under ``upload_folder``.
+
+    Session metadata and the partial file are on disk, so any web process can
+    accept the next part. The live analysis only exists in the process that
+    received every part so far; when a part lands elsewhere it is dropped and
+    mastering measures the file itself.
+    """
+
+    def __init__(self, upload_folder, max_size, max_chunk_size, loudness_cache=None, block_size=65536,
+                 session_ttl=24 * 3600, live_idle_timeout=300):
+        self.upload_folder = upload_folder
+        self.sessions_folder = os.path.join(upload_folder, SESSIONS_FOLDER)
+        self.max_size = max_size
+        self.max_chunk_size = max_chunk_size
+        self.loudness_cache = loudness_cache  # None disables the live analysis
+        self.block_size = block_size
+        self.session_ttl = session_ttl  # Abandoned sessions older than this are removed
+        self.live_idle_timeout = live_idle_timeout  # seconds without a part before a live decoder is stopped
+        self._live = {}
+        self._lock = threading.Lock()
+
+    def _paths(self, upload_id):
+        if not upload_id or not all(c in '0123456789abcdef' for c in upload_id):
+            raise UploadError('Unknown upload', 404)
+        base = os.path.join(self.sessions_folder, upload_id)
+        return f"{base}.json", f"{base}.part"
+
+    def _load(self, upload_id):
+        meta_path, part_path = self._paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError('Unknown upload', 404)
+        session['offset'] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return session
+
+    def create(self, filename, size, metadata=None):
+        filename = secure_filename(filename or '')
+        if not filename:
+            raise UploadError('Missing filename')
+        if size <= 0 or size > self.max_size:
+            raise UploadError(f'Upload size must be between 1 and {self.max_size} bytes', 413)
+
+        os.makedirs(self.sessions_folder, exist_ok=True)
+        self.purge_stale()
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+        session = {'id': upload_id, 'filename': filename, 'size': size, 'metadata': metadata or {},
+                   'created_at': time.time()}
+        with open(meta_path, 'w') as f:
+            json.dump(session, f)
+        open(part_path, 'wb').close()
+        return dict(session, offset=0)
+
+    def status(self, upload_id):
+        return self._load(upload_id)
+
+    def write_chunk(self, upload_id, offset, stream, length):
+        # Append one part at offset and return the session with its new offset
+        session = self._load(upload_id)
+        if offset != session['offset']:
+            raise UploadError(f"Expected offset {session['offset']}", 409)
+        if length is None or length > self.max_chunk_size:
+            raise UploadError(f'Parts need a Content-Length of at most {self.max_chunk_size} bytes', 413)
+        if offset + length > session['size']:
+            raise UploadError('Part extends past the declared upload size', 416)
+
+        _, part_path = self._paths(upload_id)
+        written = 0
+        with open(part_path, 'ab') as f:
+            # A retried part can arrive while the first attempt is still appending; the
+            # lock serialises them and the offset is checked again under it
+            fcntl.flock(f, fcntl.LOCK_EX)
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise UploadError(f"Expected offset {current}", 409)
+
+            live = self._live_for(upload_id, offset)
+            while written < length:
+                data = stream.read(min(COPY_SIZE, length - written))
+                if not data:
+                    break
+                if offset == 0 and written == 0:
+                    # The format is checked from the header bytes before anything is kept
+                    while len(data) < min(SNIFF_BYTES, length):
+                        more = stream.read(min(SNIFF_BYTES, length) - len(data))
+                        if not more:
+                            break
+                        data += more
+                    if sniff_format(data[:SNIFF_BYTES]) is None:
+                        f.close()
+                        self.abort(upload_id)
+                        raise UploadError('Not a WAV or MP3 file', 415)
+                f.write(data)
+                written += len(data)
+                if live is not None:
+                    live.feed(data)
+
+        session['offset'] = offset + written
+        return session
+
+    def _live_for(self, upload_id, offset):
+        if self.loudness_cache is None:
+            return None
+        self._stop_idle()
+        with self._lock:
+            live = self._live.get(upload_id)
+            if live is not None and live.offset != offset:
+                # Parts went to another process in between; the analysis has a gap
+                self._live.pop(upload_id).decoder.abort()
+                live = None
+            if live is None and offset == 0:
+                try:
+                    live = self._live[upload_id] = _LiveAnalysis(self.loudness_cache, self.block_size)
+                except OSError:
+                    # No decoder available; the upload itself does not need one
+                    live = None
+            return live
+
+    def _stop_idle(self):
+        # Stop the decoders of uploads that stopped sending parts, so abandoned uploads do not keep ffmpeg running
+        cutoff = time.monotonic() - self.live_idle_timeout
+        with self._lock:
+            idle = [upload_id for upload_id, live in self._live.items() if live.fed_at < cutoff]
+            stopped = [self._live.pop(upload_id) for upload_id in idle]
+        for live in stopped:
+            live.decoder.abort()
+
+    def finish(self, upload_id):
+        # Move a complete upload into the upload folder and return (filename, metadata)
+        session = self._load(upload_id)
+        if session['offset'] != session['size']:
+            raise UploadError('Upload is incomplete', 409)
+
+        self._stop_idle()
+        with self._lock:
+            live = self._live.pop(upload_id, None)
+        if live is not None:
+            try:
+                live.finish()
+            except Exception:
+                # Only the shortcut is lost; mastering measures the file itself
+                pass
+
+        # The finished file gets a name of its own, like any other upload
+        filename = unique_name(session['filename'])
+        meta_path, part_path = self._paths(upload_id)
+        os.replace(part_path, os.path.join(self.upload_folder, filename))
+        os.remove(meta_path)
+        return filename, session['metadata']
+
+    def purge_stale(self):
+        cutoff = time.time() - self.session_ttl
+        for name in os.listdir(self.sessions_folder):
+            upload_id, extension = os.path.splitext(name)
+            try:
+                if extension == '.json' and os.path.getmtime(os.path.join(self.sessions_folder, name)) < cutoff:
+                    self.abort(upload_id)
+            except (OSError, UploadError):
+                pass
+
+    def abort(self, upload_id):
+        with self._lock:
+            live = self._live.pop(upload_id, None)
+        if live is not None:
+            live.decoder.abort()
+        for path in self._paths(upload_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass